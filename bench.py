@@ -0,0 +1,247 @@
+import argparse
+import json
+import time
+
+import chess
+
+from minimax import Agent
+from position import Position, perft
+
+# Positions used for search benchmarks.
+BENCHMARK_POSITIONS = {
+    'start': chess.STARTING_FEN,
+    'italian': 'r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3',
+    'kiwipete': 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+    'endgame': '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+}
+
+# Standard perft positions, with their known leaf counts from depth 1 upwards.
+PERFT_POSITIONS = {
+    'start': (chess.STARTING_FEN, [20, 400, 8902, 197281, 4865609]),
+    'kiwipete': (
+        'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+        [48, 2039, 97862, 4085603],
+    ),
+    'position3': ('8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1', [14, 191, 2812, 43238, 674624]),
+    'position4': (
+        'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',
+        [6, 264, 9467, 422333],
+    ),
+    'position5': ('rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8', [44, 1486, 62379, 2103487]),
+}
+
+# Tactical test positions, with their best moves.
+TACTICS_PATH = 'resources/tactics.epd'
+
+
+def benchmark_perft(depth):
+    """Checks perft counts of the search's move generator against the known values, and measures its speed."""
+
+    results = []
+
+    for name, (fen, expected) in PERFT_POSITIONS.items():
+        position_depth = min(depth, len(expected))
+
+        start = time.perf_counter()
+        nodes = perft(Position(chess.Board(fen)), position_depth)
+        elapsed = time.perf_counter() - start
+
+        results.append({
+            'position': name,
+            'depth': position_depth,
+            'nodes': nodes,
+            'expected': expected[position_depth - 1],
+            'correct': nodes == expected[position_depth - 1],
+            'time': round(elapsed, 4),
+            'nps': round(nodes / elapsed),
+        })
+
+    return results
+
+
+def benchmark_tactics(path=TACTICS_PATH, movetime=5.0, max_depth=None, options=None):
+    """Measures the time and nodes each position of an EPD suite takes to find its best move.
+
+    A position counts as solved from the first iteration after which the best
+    move stays one of the 'bm' moves until the end of the search. Options are
+    passed on to the Agent.
+    """
+
+    results = []
+
+    with open(path) as epd:
+        lines = [line for line in epd if line.strip()]
+
+    for line in lines:
+        board, operations = chess.Board.from_epd(line)
+        best_moves = operations['bm']
+
+        agent = Agent(**(options or {}))
+        solution = {}
+        start = time.perf_counter()
+
+        def on_iteration(depth, evaluation, principal_variation):
+            if principal_variation and principal_variation[0] in best_moves:
+                if not solution:
+                    solution.update(depth=depth, time=time.perf_counter() - start, nodes=agent.nodes)
+            else:
+                solution.clear()
+
+        move, evaluation = agent.search(board, movetime=movetime, max_depth=max_depth, on_iteration=on_iteration)
+        elapsed = time.perf_counter() - start
+
+        # Shortcuts such as a single legal move skip the iterations.
+        if not solution and move in best_moves:
+            solution.update(depth=agent.depth, time=elapsed, nodes=agent.nodes)
+
+        results.append({
+            'id': operations.get('id'),
+            'best_moves': [board.san(best_move) for best_move in best_moves],
+            'move': board.san(move),
+            'solved': bool(solution),
+            'depth': solution.get('depth'),
+            'time_to_solution': round(solution['time'], 4) if solution else None,
+            'nodes_to_solution': solution.get('nodes'),
+            'time': round(elapsed, 4),
+            'nodes': agent.nodes,
+        })
+
+        agent.close()
+
+    return {
+        'solved': sum(result['solved'] for result in results),
+        'total': len(results),
+        'positions': results,
+    }
+
+
+def benchmark_nps(depth, hash_size_mb=16, options=None):
+    """Measures nodes per second searching each benchmark position to a fixed depth. Options are passed on to the Agent."""
+
+    agent = Agent(hash_size_mb=hash_size_mb, **(options or {}))
+    total_time = 0
+    total_nodes = 0
+    positions = {}
+
+    for name, fen in BENCHMARK_POSITIONS.items():
+        agent.transposition_table.clear()
+
+        start = time.perf_counter()
+        move, evaluation = agent.search(chess.Board(fen), max_depth=depth)
+        elapsed = time.perf_counter() - start
+
+        positions[name] = {
+            'move': move.uci(),
+            'evaluation': evaluation,
+            'time': round(elapsed, 4),
+            'nodes': agent.nodes,
+            'nps': round(agent.nodes / elapsed),
+            'stats': agent.stats.as_dict(),
+        }
+        total_time += elapsed
+        total_nodes += agent.nodes
+
+    agent.close()
+
+    return {
+        'depth': depth,
+        'time': round(total_time, 4),
+        'nodes': total_nodes,
+        'nps': round(total_nodes / total_time),
+        'positions': positions,
+    }
+
+
+def benchmark_smp(depth, worker_counts, hash_size_mb=16):
+    """Measures time-to-depth and nodes per second for each number of workers."""
+
+    results = []
+
+    for workers in worker_counts:
+
+        agent = Agent(hash_size_mb=hash_size_mb, workers=workers)
+
+        # Warm up, so starting the helper processes is not timed.
+        agent.search(chess.Board(), max_depth=1)
+
+        total_time = 0
+        total_nodes = 0
+        positions = {}
+
+        for name, fen in BENCHMARK_POSITIONS.items():
+
+            # Start every position with an empty table, so runs are comparable.
+            agent.transposition_table.clear()
+
+            start = time.perf_counter()
+            move, evaluation = agent.search(chess.Board(fen), max_depth=depth)
+            elapsed = time.perf_counter() - start
+
+            positions[name] = {
+                'move': move.uci(),
+                'evaluation': evaluation,
+                'time': round(elapsed, 4),
+                'nodes': agent.nodes,
+            }
+            total_time += elapsed
+            total_nodes += agent.nodes
+
+        agent.close()
+
+        results.append({
+            'workers': workers,
+            'depth': depth,
+            'time': round(total_time, 4),
+            'nodes': total_nodes,
+            'nps': round(total_nodes / total_time),
+            'positions': positions,
+        })
+
+    # Report speed-ups relative to the first worker count.
+    for result in results:
+        result['time_to_depth_speedup'] = round(results[0]['time'] / result['time'], 3)
+        result['nps_speedup'] = round(result['nps'] / results[0]['nps'], 3)
+
+    return results
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Benchmarks the search. Results are printed as JSON.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    perft_parser = subparsers.add_parser('perft', help='move generation counts and speed')
+    perft_parser.add_argument('--depth', type=int, default=3)
+
+    tactics_parser = subparsers.add_parser('tactics', help='time to solve the positions of an EPD suite')
+    tactics_parser.add_argument('--epd', default=TACTICS_PATH)
+    tactics_parser.add_argument('--movetime', type=float, default=5.0, help='seconds per position')
+    tactics_parser.add_argument('--depth', type=int, help='maximum depth per position')
+    tactics_parser.add_argument('--options', default='{}', help='Agent options, as JSON')
+
+    nps_parser = subparsers.add_parser('nps', help='nodes per second at a fixed depth')
+    nps_parser.add_argument('--depth', type=int, default=4)
+    nps_parser.add_argument('--hash', type=int, default=16, help='transposition table size in MB')
+    nps_parser.add_argument('--options', default='{}', help='Agent options, as JSON')
+
+    smp_parser = subparsers.add_parser('smp', help='parallel search scaling by number of workers')
+    smp_parser.add_argument('--depth', type=int, default=4)
+    smp_parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    smp_parser.add_argument('--hash', type=int, default=16, help='transposition table size in MB')
+
+    args = parser.parse_args()
+
+    if args.command == 'perft':
+        results = benchmark_perft(args.depth)
+    elif args.command == 'tactics':
+        results = benchmark_tactics(args.epd, args.movetime, args.depth, json.loads(args.options))
+    elif args.command == 'nps':
+        results = benchmark_nps(args.depth, args.hash, json.loads(args.options))
+    elif args.command == 'smp':
+        results = benchmark_smp(args.depth, args.workers, args.hash)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
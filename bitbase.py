@@ -0,0 +1,511 @@
+import argparse
+import mmap
+import os
+import struct
+import time
+from array import array
+from collections import defaultdict
+
+import chess
+
+# Header of a bitbase file: magic, material (e.g. b'KRRK'), bits per entry and entry count.
+MAGIC = b'CBB1'
+HEADER_STRUCT = struct.Struct('<4s8sBQ')
+EXTENSION = '.bb'
+
+# Results, from the point of view of the side to move.
+WIN = 1
+DRAW = 0
+LOSS = -1
+
+# Pieces are listed in this order after the king in material strings.
+PIECE_ORDER = (chess.QUEEN, chess.ROOK, chess.BISHOP, chess.KNIGHT, chess.PAWN)
+
+# Position states during generation.
+_ILLEGAL = 0
+_UNKNOWN = 1
+_RESOLVED = 2
+
+
+def parse_material(material):
+    """Splits a material string such as 'KRRK' into white and black piece types."""
+
+    material = material.upper()
+    split = material.index('K', 1)
+    white, black = material[:split], material[split:]
+
+    if white[0] != 'K' or black[0] != 'K' or 'K' in white[1:] + black[1:]:
+        raise ValueError(f'invalid material: {material!r}')
+
+    return (
+        [chess.PIECE_SYMBOLS.index(symbol.lower()) for symbol in white],
+        [chess.PIECE_SYMBOLS.index(symbol.lower()) for symbol in black],
+    )
+
+
+def material_of(board):
+    """Returns the material string of a board, such as 'KRRK'."""
+
+    material = ''
+    for colour in (chess.WHITE, chess.BLACK):
+        material += 'K'
+        for piece_type in PIECE_ORDER:
+            material += chess.piece_symbol(piece_type).upper() * len(board.pieces(piece_type, colour))
+
+    return material
+
+
+class _Layout:
+    """Maps positions of one material set to table indices and back.
+
+    Positions are flipped so that the white king is on the a-d files, and for
+    sets without pawns also on ranks 1-4. No square is its own mirror image,
+    so every position has exactly one index.
+    """
+
+    def __init__(self, material):
+        self.material = material
+        white, black = parse_material(material)
+
+        self.pieces = [(chess.WHITE, piece_type) for piece_type in white]
+        self.pieces += [(chess.BLACK, piece_type) for piece_type in black]
+        self.has_pawns = chess.PAWN in white + black
+
+        self.king_squares = 32 if self.has_pawns else 16
+        self.size = 2 * self.king_squares * 64 ** (len(self.pieces) - 1)
+
+    def canonical(self, squares):
+        """Mirrors squares (white king first) so the white king is in the indexed region."""
+
+        if squares[0] & 7 > 3:
+            squares = [square ^ 7 for square in squares]
+        if not self.has_pawns and squares[0] >> 3 > 3:
+            squares = [square ^ 56 for square in squares]
+
+        return squares
+
+    def index(self, squares, turn):
+        """Returns the index of a position, given canonical squares in piece order."""
+
+        index = 0
+        for square in reversed(squares[1:]):
+            index = index * 64 + square
+
+        king = squares[0]
+        index = index * self.king_squares + (king >> 3) * 4 + (king & 7)
+
+        return index * 2 + (turn == chess.BLACK)
+
+    def decode(self, index):
+        """Returns the canonical squares and turn of an index."""
+
+        index, black = divmod(index, 2)
+        index, king = divmod(index, self.king_squares)
+        squares = [(king >> 2) * 8 + (king & 3)]
+
+        for _ in range(len(self.pieces) - 1):
+            index, square = divmod(index, 64)
+            squares.append(square)
+
+        return squares, chess.BLACK if black else chess.WHITE
+
+    def squares_of(self, board):
+        """Returns the squares of a board's pieces in piece order."""
+
+        squares = []
+        seen = {}
+        for colour, piece_type in self.pieces:
+            # Identical pieces are listed in square order.
+            occupied = sorted(board.pieces(piece_type, colour))
+            squares.append(occupied[seen.get((colour, piece_type), 0)])
+            seen[colour, piece_type] = seen.get((colour, piece_type), 0) + 1
+
+        return squares
+
+
+class Bitbase:
+    """A memory-mapped distance-to-mate table for one material set."""
+
+    def __init__(self, path):
+        self.path = path
+
+        with open(path, 'rb') as file:
+            self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, material, self.bits, self.size = HEADER_STRUCT.unpack_from(self.mmap)
+        if magic != MAGIC:
+            raise IOError(f'not a bitbase: {path!r}')
+
+        self.material = material.rstrip(b'\0').decode('ascii')
+        self.layout = _Layout(self.material)
+        self.mask = (1 << self.bits) - 1
+
+    def code(self, index):
+        """Returns the packed entry at an index: 0 for a draw, otherwise the distance to mate in plies plus one."""
+        bit = index * self.bits
+        offset = HEADER_STRUCT.size + (bit >> 3)
+        return (int.from_bytes(self.mmap[offset:offset + 4], 'little') >> (bit & 7)) & self.mask
+
+    def probe(self, board):
+        """Returns (result, plies to mate) for the side to move, for a board of this material set."""
+
+        layout = self.layout
+        squares = layout.canonical(layout.squares_of(board))
+        code = self.code(layout.index(squares, board.turn))
+
+        return _decode_result(code)
+
+    def close(self):
+        """Unmaps the table."""
+        self.mmap.close()
+
+
+def _decode_result(code):
+    """Converts a packed entry to (result, plies)."""
+    if not code:
+        return DRAW, 0
+    plies = code - 1
+    return (WIN if plies & 1 else LOSS), plies
+
+
+class Bitbases:
+    """A collection of bitbases, probed by the material on the board."""
+
+    def __init__(self, directory=None):
+        self.tables = {}
+        self.max_pieces = 0
+
+        if directory is not None:
+            for name in sorted(os.listdir(directory)):
+                if name.endswith(EXTENSION):
+                    self.add(Bitbase(os.path.join(directory, name)))
+
+    def add(self, table):
+        """Makes a table available for probing."""
+        self.tables[table.material] = table
+        self.max_pieces = max(self.max_pieces, len(table.layout.pieces))
+
+    def probe(self, board):
+        """Returns (result, plies to mate) for the side to move, or None if the position is not covered."""
+
+        if chess.popcount(board.occupied) > self.max_pieces or board.castling_rights:
+            return None
+
+        # Every table has both kings.
+        if board.king(chess.WHITE) is None or board.king(chess.BLACK) is None:
+            return None
+
+        # The tables do not account for en passant captures.
+        if board.ep_square is not None and board.has_legal_en_passant():
+            return None
+
+        table = self.tables.get(material_of(board))
+        if table is not None:
+            return table.probe(board)
+
+        # Tables are only stored with the stronger side as white.
+        mirrored = board.mirror()
+        table = self.tables.get(material_of(mirrored))
+        if table is not None:
+            return table.probe(mirrored)
+
+        return None
+
+    def probe_move(self, board, move):
+        """Returns (result, plies to mate) after a move, for the side making it, or None if not covered."""
+
+        board.push(move)
+        try:
+            if board.is_checkmate():
+                return WIN, 1
+            if board.is_insufficient_material() or board.is_stalemate():
+                return DRAW, 0
+
+            result = self.probe(board)
+            if result is None:
+                return None
+            return -result[0], result[1] + 1 if result[0] != DRAW else 0
+        finally:
+            board.pop()
+
+    def best_move(self, board):
+        """Returns the move that wins fastest, draws, or loses slowest, with its (result, plies), or None."""
+
+        if self.probe(board) is None:
+            return None
+
+        best = None
+        for move in board.legal_moves:
+            result = self.probe_move(board, move)
+            if result is None:
+                return None
+
+            outcome, plies = result
+            key = (outcome, -plies if outcome == WIN else plies)
+            if best is None or key > best[0]:
+                best = key, move, result
+
+        if best is None:
+            return None
+        return best[1], best[2]
+
+    def close(self):
+        """Unmaps all tables."""
+        for table in self.tables.values():
+            table.close()
+
+
+def _retro_moves(piece_type, colour, square, occupied):
+    """Returns the squares a piece could have come from, without capturing, to reach a square."""
+
+    empty = ~occupied & chess.BB_ALL
+
+    if piece_type == chess.PAWN:
+        step = -8 if colour == chess.WHITE else 8
+        start_rank = 3 if colour == chess.WHITE else 4
+        origin = square + step
+
+        if not 0 <= origin < 64 or not chess.BB_SQUARES[origin] & empty:
+            return 0
+        if chess.square_rank(origin) in (0, 7):
+            return 0
+
+        origins = chess.BB_SQUARES[origin]
+        if chess.square_rank(square) == start_rank and chess.BB_SQUARES[origin + step] & empty:
+            origins |= chess.BB_SQUARES[origin + step]
+        return origins
+
+    if piece_type == chess.KING:
+        return chess.BB_KING_ATTACKS[square] & empty
+    if piece_type == chess.KNIGHT:
+        return chess.BB_KNIGHT_ATTACKS[square] & empty
+
+    attacks = 0
+    if piece_type in (chess.BISHOP, chess.QUEEN):
+        attacks |= chess.BB_DIAG_ATTACKS[square][chess.BB_DIAG_MASKS[square] & occupied]
+    if piece_type in (chess.ROOK, chess.QUEEN):
+        attacks |= chess.BB_RANK_ATTACKS[square][chess.BB_RANK_MASKS[square] & occupied]
+        attacks |= chess.BB_FILE_ATTACKS[square][chess.BB_FILE_MASKS[square] & occupied]
+
+    return attacks & empty
+
+
+def generate(material, bitbases, verbose=False):
+    """Solves a material set by retrograde analysis, returning the packed entry of each index.
+
+    Captures and promotions leave the material set, so their results are looked
+    up in bitbases, which must already hold the smaller sets they lead to.
+    """
+
+    layout = _Layout(material)
+    size = layout.size
+    pieces = layout.pieces
+
+    state = bytearray(size)
+    codes = array('H', bytes(2 * size))
+    # Moves that stay within the set and are not yet known to lose.
+    unresolved = bytearray(size)
+    # Whether a capture or promotion avoids losing.
+    escapes = bytearray(size)
+    # The longest loss among moves known to lose.
+    longest_loss = bytearray(size)
+
+    buckets = defaultdict(list)
+    board = chess.Board(None)
+    start = time.monotonic()
+
+    # Find the legal positions, their internal moves, and the results of moves that leave the set.
+    for index in range(size):
+
+        squares, turn = layout.decode(index)
+        if len(set(squares)) != len(squares):
+            continue
+
+        board.clear_board()
+        for (colour, piece_type), square in zip(pieces, squares):
+            board.set_piece_at(square, chess.Piece(piece_type, colour))
+        board.turn = turn
+
+        if board.pawns & chess.BB_BACKRANKS:
+            continue
+        if board.is_attacked_by(turn, board.king(not turn)):
+            continue
+
+        state[index] = _UNKNOWN
+        moves = 0
+
+        for move in board.generate_legal_moves():
+            moves += 1
+
+            if not move.promotion and not board.is_capture(move):
+                unresolved[index] += 1
+                continue
+
+            result = bitbases.probe_move(board, move)
+            if result is None:
+                raise ValueError(f'{material} needs a bitbase for {board.fen()} after {move}')
+
+            outcome, plies = result
+            if outcome == WIN:
+                buckets[plies].append(index)
+                escapes[index] = 1
+            elif outcome == DRAW:
+                escapes[index] = 1
+            else:
+                longest_loss[index] = max(longest_loss[index], plies)
+
+        if not moves:
+            # Checkmate is a loss in zero plies. Stalemate is a draw.
+            if board.is_check():
+                buckets[0].append(index)
+            else:
+                state[index] = _RESOLVED
+        elif not unresolved[index] and not escapes[index]:
+            buckets[longest_loss[index]].append(index)
+
+    if verbose:
+        print(f'{material}: indexed {size} positions in {time.monotonic() - start:.1f}s')
+
+    # Resolve positions in order of distance to mate, working back from the mates.
+    plies = 0
+    while buckets:
+
+        for index in buckets.pop(plies, ()):
+
+            if state[index] != _UNKNOWN:
+                continue
+
+            state[index] = _RESOLVED
+            codes[index] = plies + 1
+            wins = plies & 1
+
+            # Find the positions one move earlier, with the other side to move.
+            squares, turn = layout.decode(index)
+            occupied = 0
+            for square in squares:
+                occupied |= chess.BB_SQUARES[square]
+
+            for i, (colour, piece_type) in enumerate(pieces):
+                if colour == turn:
+                    continue
+
+                for origin in chess.scan_forward(_retro_moves(piece_type, colour, squares[i], occupied)):
+
+                    previous_squares = squares[:]
+                    previous_squares[i] = origin
+                    previous = layout.index(layout.canonical(previous_squares), colour)
+
+                    if state[previous] != _UNKNOWN:
+                        continue
+
+                    if not wins:
+                        # Moving into a lost position wins.
+                        buckets[plies + 1].append(previous)
+                    else:
+                        # Losing positions are those where every move loses.
+                        unresolved[previous] -= 1
+                        longest_loss[previous] = max(longest_loss[previous], plies + 1)
+                        if not unresolved[previous] and not escapes[previous]:
+                            buckets[longest_loss[previous]].append(previous)
+
+        plies += 1
+
+    if verbose:
+        print(f'{material}: solved in {time.monotonic() - start:.1f}s, longest mate {max(codes) - 1} plies')
+
+    return codes
+
+
+def write_bitbase(path, material, codes):
+    """Writes entries bit-packed, with just enough bits for the longest mate."""
+
+    bits = max(1, max(codes).bit_length())
+    packed = bytearray((len(codes) * bits + 7) // 8 + 4)
+
+    bit = 0
+    for code in codes:
+        if code:
+            packed[bit >> 3:(bit >> 3) + 4] = (
+                int.from_bytes(packed[bit >> 3:(bit >> 3) + 4], 'little') | code << (bit & 7)
+            ).to_bytes(4, 'little')
+        bit += bits
+
+    with open(path, 'wb') as file:
+        file.write(HEADER_STRUCT.pack(MAGIC, material.encode('ascii'), bits, len(codes)))
+        file.write(packed)
+
+
+def generate_bitbases(materials, directory, verbose=False):
+    """Generates bitbases for material sets, and the smaller sets they depend on, into a directory."""
+
+    os.makedirs(directory, exist_ok=True)
+    bitbases = Bitbases(directory)
+
+    def solve(material):
+        if material in bitbases.tables:
+            return
+        for dependency in _dependencies(material):
+            solve(dependency)
+
+        path = os.path.join(directory, material + EXTENSION)
+        write_bitbase(path, material, generate(material, bitbases, verbose))
+        bitbases.add(Bitbase(path))
+
+    for material in materials:
+        solve(_normalize(material))
+
+    return bitbases
+
+
+def _dependencies(material):
+    """Returns the material sets reachable by one capture or promotion, other than bare draws."""
+
+    white, black = parse_material(material)
+    reachable = set()
+
+    for side, other in ((white, black), (black, white)):
+        for i, piece_type in enumerate(side[1:], 1):
+            # Capture the piece.
+            reachable.add(_normalize(_material_string(side[:i] + side[i + 1:], other)))
+            # Promote the piece.
+            if piece_type == chess.PAWN:
+                for promotion in (chess.QUEEN, chess.ROOK, chess.BISHOP, chess.KNIGHT):
+                    reachable.add(_normalize(_material_string(side[:i] + [promotion] + side[i + 1:], other)))
+
+    # A lone minor piece cannot mate, so those sets are drawn without a table.
+    return sorted(material for material in reachable if len(material) > 3 or material in ('KQK', 'KRK', 'KPK'))
+
+
+def _material_string(white, black):
+    """Returns the material string of lists of white and black piece types."""
+    return ''.join(chess.piece_symbol(piece_type).upper() for piece_type in white + black)
+
+
+def _strength(material):
+    """Scores a material string by the white side's advantage, for picking which side is white."""
+    white, black = parse_material(material)
+    values = {chess.PAWN: 1, chess.KNIGHT: 3, chess.BISHOP: 3, chess.ROOK: 5, chess.QUEEN: 9, chess.KING: 0}
+    return sum(values[piece_type] for piece_type in white) - sum(values[piece_type] for piece_type in black), material
+
+
+def _normalize(material):
+    """Orders the pieces of a material string, with the stronger side as white."""
+    white, black = parse_material(material)
+    white = [chess.KING] + sorted(white[1:], key=PIECE_ORDER.index)
+    black = [chess.KING] + sorted(black[1:], key=PIECE_ORDER.index)
+    return max(_material_string(white, black), _material_string(black, white), key=_strength)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Generates endgame bitbases by retrograde analysis.')
+    parser.add_argument('materials', nargs='+', help='material sets to generate, such as KQK KRK KRRK KPK')
+    parser.add_argument('-o', '--output', default='resources/bitbases', help='directory to write bitbases to')
+
+    args = parser.parse_args()
+
+    generate_bitbases(args.materials, args.output, verbose=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+import argparse
+import struct
+from collections import defaultdict
+
+import chess
+import chess.pgn
+import chess.polyglot
+
+# Each book entry is a key, move, weight and learn value, big-endian.
+ENTRY_STRUCT = struct.Struct('>QHHI')
+
+# Polyglot promotion codes.
+PROMOTION_CODES = {
+    None: 0,
+    chess.KNIGHT: 1,
+    chess.BISHOP: 2,
+    chess.ROOK: 3,
+    chess.QUEEN: 4,
+}
+
+
+class OpeningBook:
+    """A Polyglot opening book.
+
+    The file is memory-mapped and looked up by binary search over its sorted
+    entries, so opening it is instant and processes share the same pages.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.reader = chess.polyglot.open_reader(path)
+
+    def choose_move(self, board, random=None):
+        """Picks a book move for a position with probability proportional to its weight, or returns None."""
+        try:
+            return self.reader.weighted_choice(board, random=random).move
+        except IndexError:
+            return None
+
+    def close(self):
+        """Unmaps the book file."""
+        self.reader.close()
+
+
+def encode_move(board, move):
+    """Returns the Polyglot encoding of a move. Castling is encoded as the king taking its own rook."""
+
+    to_square = move.to_square
+
+    if board.is_castling(move):
+        rank = chess.square_rank(move.from_square)
+        to_square = chess.square(7 if board.is_kingside_castling(move) else 0, rank)
+
+    return to_square | move.from_square << 6 | PROMOTION_CODES[move.promotion] << 12
+
+
+def build_book(pgn_paths, output_path, min_games=1, max_ply=16):
+    """Builds a Polyglot book from the games in PGN files.
+
+    Moves are weighted by the score they achieved for the side that played them
+    (2 for a win, 1 for a draw). Only moves played in at least min_games games,
+    within the first max_ply half-moves, are kept. Returns the number of entries written.
+    """
+
+    # Games played and points scored, by position and move.
+    statistics = defaultdict(lambda: [0, 0])
+
+    for pgn_path in pgn_paths:
+        with open(pgn_path, encoding='utf-8', errors='replace') as pgn:
+            while True:
+                game = chess.pgn.read_game(pgn)
+                if game is None:
+                    break
+
+                result = game.headers.get('Result', '*')
+                points = {chess.WHITE: 0, chess.BLACK: 0}
+                if result == '1-0':
+                    points[chess.WHITE] = 2
+                elif result == '0-1':
+                    points[chess.BLACK] = 2
+                elif result == '1/2-1/2':
+                    points[chess.WHITE] = points[chess.BLACK] = 1
+
+                board = game.board()
+                for ply, move in enumerate(game.mainline_moves()):
+                    if ply >= max_ply:
+                        break
+
+                    entry = statistics[chess.polyglot.zobrist_hash(board), encode_move(board, move)]
+                    entry[0] += 1
+                    entry[1] += points[board.turn]
+                    board.push(move)
+
+    entries = [
+        (key, raw_move, points)
+        for (key, raw_move), (games, points) in statistics.items()
+        if games >= min_games and points > 0
+    ]
+
+    # Weights are 16-bit, so scale them down if necessary.
+    scale = max((points for _, _, points in entries), default=0) / 0xffff
+    if scale > 1:
+        entries = [(key, raw_move, max(1, int(points / scale))) for key, raw_move, points in entries]
+
+    # Readers binary search on the key, and list the moves of each key by weight.
+    entries.sort(key=lambda entry: (entry[0], -entry[2]))
+
+    with open(output_path, 'wb') as book:
+        for key, raw_move, weight in entries:
+            book.write(ENTRY_STRUCT.pack(key, raw_move, weight, 0))
+
+    return len(entries)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Builds a Polyglot opening book from PGN files.')
+    parser.add_argument('pgn', nargs='+', help='PGN files to read games from')
+    parser.add_argument('-o', '--output', required=True, help='path of the book to write')
+    parser.add_argument('--min-games', type=int, default=1, help='minimum number of games a move must be played in')
+    parser.add_argument('--max-ply', type=int, default=16, help='number of half-moves of each game to include')
+
+    args = parser.parse_args()
+
+    count = build_book(args.pgn, args.output, args.min_games, args.max_ply)
+    print(f'Wrote {count} entries to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
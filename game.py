@@ -0,0 +1,21 @@
+import chess
+
+
+class LocalGame:
+    """A game between two players on one board."""
+
+    def __init__(self, white, black, fen=chess.STARTING_FEN):
+        self.board = chess.Board(fen)
+        self.white = white
+        self.black = black
+
+    def player_to_move(self):
+        """Returns the player whose turn it is."""
+        return self.white if self.board.turn == chess.WHITE else self.black
+
+
+class Player:
+    """A player known only by name, such as a human at the board."""
+
+    def __init__(self, name):
+        self.name = name
@@ -0,0 +1,427 @@
+import argparse
+import functools
+import heapq
+import itertools
+import json
+import socketserver
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import chess
+
+from game import LocalGame, Player
+from match import build_agent
+from transposition import TranspositionTable
+
+# Seconds the engine thinks per move, while no more games are waiting than there are workers.
+DEFAULT_MOVETIME = 1.0
+
+# However many games are waiting, a move always gets at least this many seconds.
+MIN_MOVETIME = 0.05
+
+COLOUR_NAMES = {chess.WHITE: 'white', chess.BLACK: 'black'}
+
+
+class HostedGame:
+    """A game between a client and the engine, with the timings of the engine's replies."""
+
+    def __init__(self, game_id, engine_colour, send, fen=chess.STARTING_FEN):
+        engine, client = Player('engine'), Player('client')
+        white, black = (engine, client) if engine_colour == chess.WHITE else (client, engine)
+
+        self.id = game_id
+        self.game = LocalGame(white, black, fen)
+        self.board = self.game.board
+        self.engine_colour = engine_colour
+        self.send = send
+        self.closed = False
+
+        # The engine time the game has had so far, which the scheduler shares out fairly.
+        self.think_time = 0.0
+
+        # When the engine's reply was first waited for, and how long each reply took in the end.
+        self.waiting_since = None
+        self.latencies = []
+
+    def engine_to_move(self):
+        """Checks whether the game is waiting for the engine."""
+        return self.board.turn == self.engine_colour and not self.board.is_game_over(claim_draw=True)
+
+    def summary(self):
+        """Returns the state of the game and the latencies of the engine's replies."""
+
+        latencies = self.latencies
+
+        return {
+            'game': self.id,
+            'engine': COLOUR_NAMES[self.engine_colour],
+            'fen': self.board.fen(),
+            'moves': len(self.board.move_stack),
+            'waiting': self.waiting_since is not None,
+            'think_time': round(self.think_time, 3),
+            'last_latency': round(latencies[-1], 3) if latencies else None,
+            'mean_latency': round(sum(latencies) / len(latencies), 3) if latencies else None,
+            'max_latency': round(max(latencies), 3) if latencies else None,
+        }
+
+
+class GameHost:
+    """Plays many games against clients at once, sharing a pool of engine processes between them.
+
+    The engine only thinks about games whose client has just moved. The games
+    that have had the least engine time so far go first, then the ones that have
+    waited longest. When more games are waiting than there are workers, each
+    move gets proportionally less time, so that replies stay prompt under load.
+    Events of each game are passed to the send function it was created with.
+    """
+
+    def __init__(self, workers=2, movetime=DEFAULT_MOVETIME, agent_options=None):
+        self.workers = workers
+        self.movetime = movetime
+        self.games = {}
+        self._game_ids = itertools.count(1)
+
+        # Searches finish on the pool's thread, so the scheduler's state is shared with it.
+        self._lock = threading.RLock()
+        self._idle = threading.Condition(self._lock)
+
+        # Games waiting for the engine, as a heap of (think time, waiting since, sequence number, game).
+        self._queue = []
+        self._sequence = itertools.count()
+        self._searching = 0
+        self.max_queue_depth = 0
+        self.moves_played = 0
+
+        # Workers share a hash file if given one. It is set up before they start, so they all map the same file.
+        agent_options = dict(agent_options or {})
+        if agent_options.get('hash_path'):
+            TranspositionTable(
+                agent_options.get('hash_size_mb', 16), path=agent_options['hash_path'],
+                warm_start=agent_options.get('warm_start', True),
+            ).close()
+            agent_options['warm_start'] = True
+
+        self._pool = ProcessPoolExecutor(max_workers=workers, initializer=_initialize_worker,
+                                         initargs=(agent_options,))
+
+    def new_game(self, send, engine_colour=chess.BLACK, fen=chess.STARTING_FEN):
+        """Starts a game against a client, and the engine's search if it moves first. Returns the game."""
+
+        with self._lock:
+            game = HostedGame(next(self._game_ids), engine_colour, send, fen)
+            self.games[game.id] = game
+            game.send({'event': 'created', 'game': game.id, 'engine': COLOUR_NAMES[engine_colour], 'fen': game.board.fen()})
+
+            if game.engine_to_move():
+                self._enqueue(game)
+            else:
+                self._check_game_over(game)
+
+        self._dispatch()
+        return game
+
+    def play(self, game_id, uci):
+        """Plays a client's move, and queues the engine's reply.
+
+        Raises ValueError if there is no such game, it is not the client's turn,
+        or the move is illegal.
+        """
+
+        with self._lock:
+            game = self.games.get(game_id)
+            if game is None:
+                raise ValueError(f'no game {game_id}')
+
+            board = game.board
+            if board.turn == game.engine_colour or board.is_game_over(claim_draw=True):
+                raise ValueError(f'game {game_id} is not waiting for a move')
+
+            move = chess.Move.from_uci(uci)
+            if move not in board.legal_moves:
+                raise ValueError(f'illegal move {uci} in game {game_id}')
+
+            board.push(move)
+
+            if game.engine_to_move():
+                self._enqueue(game)
+            else:
+                self._check_game_over(game)
+
+        self._dispatch()
+
+    def close_game(self, game_id):
+        """Stops hosting a game. A search already underway for it runs to the end, but its move is dropped."""
+
+        with self._lock:
+            game = self.games.pop(game_id, None)
+            if game is None:
+                raise ValueError(f'no game {game_id}')
+
+            game.closed = True
+            self._queue = [entry for entry in self._queue if entry[-1] is not game]
+            heapq.heapify(self._queue)
+            self._idle.notify_all()
+
+    def status(self):
+        """Returns the depth of the queue, and the latencies of the engine's replies in all games and each one."""
+
+        with self._lock:
+            latencies = [latency for game in self.games.values() for latency in game.latencies]
+
+            return {
+                'queue_depth': len(self._queue),
+                'max_queue_depth': self.max_queue_depth,
+                'searching': self._searching,
+                'workers': self.workers,
+                'moves': self.moves_played,
+                'mean_latency': round(sum(latencies) / len(latencies), 3) if latencies else None,
+                'max_latency': round(max(latencies), 3) if latencies else None,
+                'games': [game.summary() for game in self.games.values()],
+            }
+
+    def wait(self):
+        """Waits until no game is waiting for the engine."""
+        with self._idle:
+            self._idle.wait_for(lambda: not self._queue and not self._searching)
+
+    def close(self):
+        """Stops the engine processes, dropping the replies still waiting to be searched."""
+        self._pool.shutdown(cancel_futures=True)
+
+    def _enqueue(self, game):
+        """Puts a game in line for the engine. The lock must be held."""
+
+        game.waiting_since = time.monotonic()
+        heapq.heappush(self._queue, (game.think_time, game.waiting_since, next(self._sequence), game))
+        self.max_queue_depth = max(self.max_queue_depth, len(self._queue))
+
+    def _movetime(self):
+        """Returns the time for the next search, sharing the workers' time between the games waiting. The lock must be held."""
+
+        # Count the game about to be searched, which has already left the queue.
+        waiting = len(self._queue) + self._searching + 1
+        return max(MIN_MOVETIME, self.movetime * min(1.0, self.workers / waiting))
+
+    def _dispatch(self):
+        """Starts searches for the games first in line, while there are idle workers."""
+
+        with self._lock:
+            while self._queue and self._searching < self.workers:
+                game = heapq.heappop(self._queue)[-1]
+                movetime = self._movetime()
+                self._searching += 1
+
+                future = self._pool.submit(_think, game.board.copy(), movetime)
+                future.add_done_callback(functools.partial(self._finish_search, game))
+
+    def _finish_search(self, game, future):
+        """Plays the engine's move once a search finishes, and starts the next search."""
+
+        error_message = 'no move found'
+        try:
+            move, evaluation, depth, nodes, think_time = future.result()
+        except Exception as error:
+            move, error_message = None, str(error) or type(error).__name__
+
+        events = []
+
+        with self._lock:
+            self._searching -= 1
+
+            if game.closed:
+                pass
+            elif move is None:
+                game.waiting_since = None
+                events.append({'event': 'error', 'game': game.id, 'message': f'search failed: {error_message}'})
+            else:
+                latency = time.monotonic() - game.waiting_since
+                game.board.push(move)
+                game.waiting_since = None
+                game.think_time += think_time
+                game.latencies.append(latency)
+                self.moves_played += 1
+
+                events.append({
+                    'event': 'move',
+                    'game': game.id,
+                    'move': move.uci(),
+                    'evaluation': evaluation,
+                    'depth': depth,
+                    'nodes': nodes,
+                    'latency': round(latency, 3),
+                    'fen': game.board.fen(),
+                })
+                events.extend(self._game_over_events(game))
+
+        for event in events:
+            game.send(event)
+
+        self._dispatch()
+
+        with self._idle:
+            self._idle.notify_all()
+
+    def _check_game_over(self, game):
+        """Tells the client if a game has just ended. The lock must be held."""
+        for event in self._game_over_events(game):
+            game.send(event)
+
+    def _game_over_events(self, game):
+        """Returns the event announcing the result of a game, if it is over."""
+        if not game.board.is_game_over(claim_draw=True):
+            return []
+        return [{'event': 'game_over', 'game': game.id, 'result': game.board.result(claim_draw=True)}]
+
+
+class Session:
+    """Handles the messages of one client, one JSON object per line, and writes its events the same way.
+
+    Commands are 'new' (with optional 'engine' colour and 'fen'), 'move' (with
+    'game' and a UCI 'move'), 'status', 'close' (with 'game') and 'quit'.
+    """
+
+    def __init__(self, host, output):
+        self.host = host
+        self.output = output
+        self._output_lock = threading.Lock()
+        self.games = set()
+
+    def send(self, message):
+        """Writes a message to the client. Messages to a client that has gone are dropped."""
+        with self._output_lock:
+            try:
+                self.output.write(json.dumps(message) + '\n')
+                self.output.flush()
+            except (OSError, ValueError):
+                pass
+
+    def handle(self, line):
+        """Handles one message. Returns False when the client is done."""
+
+        try:
+            message = json.loads(line)
+            command = message['command']
+
+            if command == 'new':
+                engine_colour = {'white': chess.WHITE, 'black': chess.BLACK}[message.get('engine', 'black')]
+                game = self.host.new_game(self.send, engine_colour, message.get('fen', chess.STARTING_FEN))
+                self.games.add(game.id)
+            elif command == 'move':
+                self.host.play(self._own_game(message), message['move'])
+            elif command == 'status':
+                self.send({'event': 'status', **self.host.status()})
+            elif command == 'close':
+                game_id = self._own_game(message)
+                self.host.close_game(game_id)
+                self.games.discard(game_id)
+                self.send({'event': 'closed', 'game': game_id})
+            elif command == 'quit':
+                return False
+            else:
+                raise ValueError(f'unknown command {command}')
+
+        except (KeyError, TypeError, ValueError) as error:
+            self.send({'event': 'error', 'message': str(error)})
+
+        return True
+
+    def _own_game(self, message):
+        """Returns the id of the game a message is about, which must belong to this client."""
+
+        game_id = message['game']
+        if game_id not in self.games:
+            raise ValueError(f'no game {game_id}')
+        return game_id
+
+    def close(self):
+        """Stops hosting the client's games."""
+        for game_id in self.games:
+            self.host.close_game(game_id)
+        self.games.clear()
+
+
+class HostServer(socketserver.ThreadingTCPServer):
+    """Serves sessions to clients connecting over TCP, one thread each."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, host):
+        self.host = host
+        super().__init__(address, SessionHandler)
+
+
+class SessionHandler(socketserver.StreamRequestHandler):
+    """Runs the session of one TCP client."""
+
+    def handle(self):
+        output = self.connection.makefile('w', encoding='utf-8')
+        session = Session(self.server.host, output)
+
+        try:
+            for line in self.rfile:
+                line = line.decode('utf-8', errors='replace')
+                if line.strip() and not session.handle(line):
+                    break
+        finally:
+            session.close()
+            output.close()
+
+
+# The agent of a worker process.
+_worker_agent = None
+
+
+def _initialize_worker(options):
+    """Sets up the agent of a worker process."""
+
+    global _worker_agent
+    _worker_agent = build_agent(options)
+
+
+def _think(board, movetime):
+    """Searches a game's position in a worker process. Returns the move, evaluation, depth, nodes and time taken."""
+
+    agent = _worker_agent
+    start = time.monotonic()
+    move, evaluation = agent.search(board, movetime=movetime)
+
+    return move, evaluation, agent.depth, agent.nodes, time.monotonic() - start
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Hosts games against the engine for many clients at once, over JSON lines.')
+    parser.add_argument('--workers', type=int, default=2, help='engine processes shared by all games')
+    parser.add_argument('--movetime', type=float, default=DEFAULT_MOVETIME, help='seconds per move while the engine is not busy')
+    parser.add_argument('--options', default='{}', help='Agent options, as JSON')
+    parser.add_argument('--port', type=int, help='serve clients on this TCP port, instead of one client on stdin')
+    parser.add_argument('--address', default='127.0.0.1', help='address to serve clients on')
+
+    args = parser.parse_args()
+
+    host = GameHost(args.workers, args.movetime, json.loads(args.options))
+
+    try:
+        if args.port is not None:
+            with HostServer((args.address, args.port), host) as server:
+                server.serve_forever()
+        else:
+            session = Session(host, sys.stdout)
+            for line in sys.stdin:
+                if line.strip() and not session.handle(line):
+                    break
+            else:
+                # Input ran out, so finish the replies still owed before leaving.
+                host.wait()
+            session.close()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        host.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,54 +1,144 @@
-import tkinter as tk
-import tkinter.messagebox
+import base64
+import io
+import os
+import queue
+import struct
+import threading
+import time
 
 import chess
-from PIL import ImageTk, Image
+from game import LocalGame, Player
 from minimax import Agent
 
 CELL_WIDTH = 70
 ICON_WIDTH = int(CELL_WIDTH * 0.8)
 
-# Initialize the root widget.
-root = tk.Tk()
-root.geometry(f'{CELL_WIDTH * 8}x{CELL_WIDTH * 8}')
-root.title('Chess')
+# The icon files in each icon folder, by colour and piece type.
+ICON_NAMES = {
+    chess.WHITE: {chess.KING: 'WK', chess.QUEEN: 'WQ', chess.ROOK: 'WR', chess.KNIGHT: 'WN', chess.BISHOP: 'WB', chess.PAWN: 'WP'},
+    chess.BLACK: {chess.KING: 'BK', chess.QUEEN: 'BQ', chess.ROOK: 'BR', chess.KNIGHT: 'BN', chess.BISHOP: 'BB', chess.PAWN: 'BP'},
+}
+
+# Icons resized to ICON_WIDTH are packed into one cache file per folder and width: a header, then each
+# icon's PNG data after its length, in the order of ICON_NAMES.
+ICON_CACHE_MAGIC = b'CIC1'
+ICON_CACHE_HEADER_STRUCT = struct.Struct('<4sHB')
+ICON_CACHE_LENGTH_STRUCT = struct.Struct('<I')
+
+AI_MOVE_TIME = 1.0
+# How often to check whether the engine has finished thinking, in milliseconds.
+ENGINE_POLL_INTERVAL = 10
+# Whether the engine thinks about its reply to the expected move during the human's turn.
+ENGINE_PONDERING = True
+# The engine's transposition table is kept in this file between games, so positions reached before are
+# answered from it rather than searched again. If the file cannot be created, the table is kept in memory.
+ENGINE_HASH_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'resources', 'engine.hash')
+
+# Animations are drawn this many times a second, and last a fixed number of seconds whatever the distance.
+ANIMATION_FRAME_RATE = 60
+MOVE_ANIMATION_TIME = 0.2
+ILLEGAL_MOVE_REVERSE_ANIMATION_TIME = 0.1
+
+# Icons already loaded, by folder.
+_icons = {}
 
-MOVE_ANIMATION_SPEED = CELL_WIDTH / 50
-ILLEGAL_MOVE_REVERSE_ANIMATION_SPEED = CELL_WIDTH / 25
 
 def load_icons(path):
-    """Loads all the icons in a folder and returns a dictionary mapping each icon to its name."""
-    return {
-        chess.WHITE:{
-            chess.KING:   ImageTk.PhotoImage(Image.open(path + '/WK.png').resize((ICON_WIDTH, ICON_WIDTH))),
-            chess.QUEEN:  ImageTk.PhotoImage(Image.open(path + '/WQ.png').resize((ICON_WIDTH, ICON_WIDTH))),
-            chess.ROOK:   ImageTk.PhotoImage(Image.open(path + '/WR.png').resize((ICON_WIDTH, ICON_WIDTH))),
-            chess.KNIGHT: ImageTk.PhotoImage(Image.open(path + '/WN.png').resize((ICON_WIDTH, ICON_WIDTH))),
-            chess.BISHOP: ImageTk.PhotoImage(Image.open(path + '/WB.png').resize((ICON_WIDTH, ICON_WIDTH))),
-            chess.PAWN:   ImageTk.PhotoImage(Image.open(path + '/WP.png').resize((ICON_WIDTH, ICON_WIDTH)))
-        },  
-        chess.BLACK:{
-            chess.KING:   ImageTk.PhotoImage(Image.open(path + '/BK.png').resize((ICON_WIDTH, ICON_WIDTH))),
-            chess.QUEEN: ImageTk.PhotoImage(Image.open(path + '/BQ.png').resize((ICON_WIDTH, ICON_WIDTH))),
-            chess.ROOK:  ImageTk.PhotoImage(Image.open(path + '/BR.png').resize((ICON_WIDTH, ICON_WIDTH))),
-            chess.KNIGHT:ImageTk.PhotoImage(Image.open(path + '/BN.png').resize((ICON_WIDTH, ICON_WIDTH))),
-            chess.BISHOP:ImageTk.PhotoImage(Image.open(path + '/BB.png').resize((ICON_WIDTH, ICON_WIDTH))),
-            chess.PAWN:  ImageTk.PhotoImage(Image.open(path + '/BP.png').resize((ICON_WIDTH, ICON_WIDTH)))
+    """Loads all the icons in a folder and returns a dictionary mapping each colour and piece type to its icon.
+
+    Icons are only loaded once, and need a Tk root to exist. Resizing them needs
+    Pillow, so resized copies are cached in the folder for the next start.
+    """
+
+    if path in _icons:
+        return _icons[path]
+
+    names = [name for pieces in ICON_NAMES.values() for name in pieces.values()]
+    cache_path = os.path.join(path, f'resized-{ICON_WIDTH}.iconcache')
+
+    images = _read_icon_cache(cache_path, [os.path.join(path, name + '.png') for name in names])
+    if images is None:
+        images = _resize_icons(path, names)
+        _write_icon_cache(cache_path, images)
+
+    # Tk decodes PNG data itself, so the icons are made without Pillow.
+    import tkinter as tk
+    images = dict(zip(names, images))
+    _icons[path] = {
+        colour: {
+            piece_type: tk.PhotoImage(data=base64.b64encode(images[name]).decode('ascii'))
+            for piece_type, name in pieces.items()
         }
+        for colour, pieces in ICON_NAMES.items()
     }
 
-class LocalGame:
+    return _icons[path]
+
+
+def _resize_icons(path, names):
+    """Resizes the named icons in a folder to ICON_WIDTH, returning the PNG data of each."""
+
+    # Pillow is slow to import, so it is only loaded when the cache needs rebuilding.
+    from PIL import Image
+
+    images = []
+    for name in names:
+        with Image.open(os.path.join(path, name + '.png')) as image:
+            output = io.BytesIO()
+            image.resize((ICON_WIDTH, ICON_WIDTH)).save(output, format='PNG')
+            images.append(output.getvalue())
+
+    return images
+
+
+def _read_icon_cache(cache_path, source_paths):
+    """Returns the PNG data of each icon in a cache file, or None if it is missing or older than its sources."""
+
+    try:
+        if os.path.getmtime(cache_path) < max(os.path.getmtime(source) for source in source_paths):
+            return None
+        with open(cache_path, 'rb') as file:
+            data = file.read()
+    except OSError:
+        return None
+
+    if len(data) < ICON_CACHE_HEADER_STRUCT.size:
+        return None
+    magic, width, count = ICON_CACHE_HEADER_STRUCT.unpack_from(data)
+    if magic != ICON_CACHE_MAGIC or width != ICON_WIDTH or count != len(source_paths):
+        return None
+
+    images = []
+    offset = ICON_CACHE_HEADER_STRUCT.size
+    for _ in range(count):
+        if offset + ICON_CACHE_LENGTH_STRUCT.size > len(data):
+            return None
+        length, = ICON_CACHE_LENGTH_STRUCT.unpack_from(data, offset)
+        offset += ICON_CACHE_LENGTH_STRUCT.size
+        images.append(data[offset:offset + length])
+        offset += length
+
+    return images if offset == len(data) else None
+
+
+def _write_icon_cache(cache_path, images):
+    """Packs the PNG data of resized icons into a cache file. Nothing is cached if the folder is read-only."""
+
+    data = [ICON_CACHE_HEADER_STRUCT.pack(ICON_CACHE_MAGIC, ICON_WIDTH, len(images))]
+    for image in images:
+        data.append(ICON_CACHE_LENGTH_STRUCT.pack(len(image)))
+        data.append(image)
+
+    # Write to a temporary file first, so other instances never read half a cache.
+    temporary_path = f'{cache_path}.{os.getpid()}.tmp'
+    try:
+        with open(temporary_path, 'wb') as file:
+            file.write(b''.join(data))
+        os.replace(temporary_path, cache_path)
+    except OSError:
+        pass
 
-    def __init__(self, white, black):
-        self.board = chess.Board()
-        self.white = white
-        self.black = black
 
-class Player:
-    
-    def __init__(self, name):
-        self.name = name        
-        
 class GUI:
 
     def __init__(self, root):
@@ -58,7 +148,7 @@ class GUI:
 
         # Create a game.
         p1 = Player('1')
-        p2 = Agent()
+        p2 = Agent(hash_path=ENGINE_HASH_PATH)
         self.game = LocalGame(p1, p2)
 
         # Set up the board widget.
@@ -67,37 +157,200 @@ class GUI:
         # Draw the widget on the screen.
         self.board_widget.canvas.grid(row=0, column=0)
 
-    def ai_move(self):
-        """Makes an AI move"""
-        if self.game.board.turn == chess.BLACK:
-            # Use minimax to get the best move
-            move = self.game.black.minimax(self.game.board, 2, float('-inf'), float('+inf'), self.game.board.turn)[0]
-            # Make the move
-            self.board_widget.make_move(move)
-        self.root.after(1000, self.ai_move)
+        # The engine plays black, thinking on a worker thread.
+        self.engine_colour = chess.BLACK
+        self.engine_moves = queue.Queue()
+        self.search_thread = None
+        self.search_token = None
+
+        # The human move the engine is pondering on, if any.
+        self.ponder_move = None
+
+        # Start thinking as soon as a move is made, and stop when the window closes.
+        self.board_widget.canvas.bind('<<MoveMade>>', self.on_move_made)
+        self.root.protocol('WM_DELETE_WINDOW', self.close)
+
+    def on_move_made(self, event=None):
+        """Starts the engine if it is its turn to move."""
+
+        # Once the game is over there is nothing left to ponder.
+        if self.game.board.is_game_over(claim_draw=True):
+            self.cancel_search()
+            return
+
+        if self.game.board.turn != self.engine_colour:
+            return
+
+        # If the human played the expected move, the search is already underway.
+        if self.ponder_move is not None and self.game.board.peek() == self.ponder_move:
+            self.ponder_move = None
+            self.board_widget.locked = True
+            self.game.black.ponderhit()
+            self.root.after(ENGINE_POLL_INTERVAL, self.receive_engine_move)
+        else:
+            self.start_search()
+
+    def start_search(self, ponder_move=None):
+        """Starts searching for an AI move on a worker thread.
+
+        If ponder_move is given, searches the position after that human move
+        while waiting for the human to play.
+        """
+
+        self.cancel_search()
+
+        # The worker gets its own copy of the board and a token to cancel it with.
+        board = self.game.board.copy()
+        if ponder_move is not None:
+            board.push(ponder_move)
+
+        self.ponder_move = ponder_move
+        self.search_token = threading.Event()
+
+        # Arm pondering before the worker starts, so that a quick human move is not missed.
+        if ponder_move is not None:
+            self.game.black.begin_ponder()
+
+        self.search_thread = threading.Thread(target=self._search,
+            args=(board, self.search_token, ponder_move is not None), daemon=True)
+        self.search_thread.start()
+
+        # Keep the human from moving the engine's pieces while it thinks.
+        if ponder_move is None:
+            self.board_widget.locked = True
+            self.root.after(ENGINE_POLL_INTERVAL, self.receive_engine_move)
 
+    def _search(self, board, token, ponder):
+        """Searches for the best move within a fixed time budget. Runs on the worker thread."""
+        agent = self.game.black
+        move = agent.search(board, movetime=AI_MOVE_TIME, stop_event=token, ponder=ponder)[0]
+        self.engine_moves.put((token, move, list(agent.principal_variation)))
+
+    def receive_engine_move(self):
+        """Makes the engine's move once its search has finished."""
+
+        while True:
+            try:
+                token, move, principal_variation = self.engine_moves.get_nowait()
+            except queue.Empty:
+                break
+
+            # Ignore moves from cancelled searches.
+            if token is self.search_token and not token.is_set():
+                self.search_thread = None
+                self.search_token = None
+                self.board_widget.locked = False
+                self.board_widget.make_move(move)
+
+                # Think about the reply to the human's expected move.
+                if (ENGINE_PONDERING and len(principal_variation) >= 2 and principal_variation[0] == move
+                        and not self.game.board.is_game_over(claim_draw=True)):
+                    self.start_search(ponder_move=principal_variation[1])
+                return
+
+        if self.search_token is not None:
+            self.root.after(ENGINE_POLL_INTERVAL, self.receive_engine_move)
+
+    def cancel_search(self):
+        """Stops the engine if it is thinking."""
+
+        if self.search_thread is not None:
+            self.search_token.set()
+            self.search_thread.join()
+
+        self.search_thread = None
+        self.search_token = None
+        self.ponder_move = None
+        self.board_widget.locked = False
+
+    def close(self):
+        """Stops the engine and closes the window."""
+        self.cancel_search()
+        self.game.black.close()
+        self.root.destroy()
 
     def mainloop(self):
         """Starts and runs the GUI."""
-        self.root.after(1000, self.ai_move)
+        self.on_move_made()
         self.root.mainloop()
 
 
+class Tween:
+    """Moves a canvas object in a straight line over a fixed time."""
+
+    def __init__(self, start, end, duration, on_finish=None):
+        self.start = start
+        self.end = end
+        self.start_time = time.monotonic()
+        self.duration = duration
+        self.on_finish = on_finish
+
+    def position(self, now):
+        """Returns where the object should be at a given time, and whether it has arrived."""
+
+        fraction = min(1.0, (now - self.start_time) / self.duration) if self.duration > 0 else 1.0
+        x = self.start[0] + (self.end[0] - self.start[0]) * fraction
+        y = self.start[1] + (self.end[1] - self.start[1]) * fraction
+
+        return (x, y), fraction == 1.0
+
+
+class LegalMoveIndex:
+    """The legal moves of a position, as bitboards of the squares each square's piece can move to."""
+
+    def __init__(self, board):
+        self.targets = [0] * 64
+        self.captures = [0] * 64
+        self.promotions = [0] * 64
+        self.en_passant = [0] * 64
+
+        for move in board.legal_moves:
+            from_square = move.from_square
+            to_mask = 1 << move.to_square
+
+            self.targets[from_square] |= to_mask
+            if board.is_capture(move):
+                self.captures[from_square] |= to_mask
+            if move.promotion:
+                self.promotions[from_square] |= to_mask
+            if board.is_en_passant(move):
+                self.en_passant[from_square] |= to_mask
+
+    def is_legal(self, from_square, to_square):
+        """Checks whether a piece can move between two squares."""
+        return bool(self.targets[from_square] & (1 << to_square))
+
+
 class BoardWidget:
 
     # TODO: Flipping the board.
 
     def __init__(self, root, board, theme, pov):
+        import tkinter as tk
         self.root = root
         self.board = board
         self.theme = theme
+        self.icons = load_icons(theme['icon_path'])
         self.canvas = tk.Canvas(self.root, width=CELL_WIDTH * 8, height=CELL_WIDTH * 8) 
         self.pov = pov
         self.active_square = None
+        self.locked = False
         self.icon_tags = {}
         self.square_tags = {}
+
+        # Highlights are drawn once for every square, and shown when needed. These are the ones showing.
+        self.square_highlight_tags = {}
+        self.move_marker_tags = {}
+        self.capture_marker_tags = {}
         self.highlights = []
 
+        # The legal moves of the current position, so that input handling need not generate them again.
+        self.move_index = LegalMoveIndex(self.board)
+
+        # Animations in progress, by the tag of the object they move, and the next frame scheduled to draw them.
+        self.tweens = {}
+        self._animation_frame = None
+
         # Add functions.
         self.canvas.bind('<B1-Motion>', self.mouse_drag)
         self.canvas.bind('<ButtonPress-1>', self.mouse_click)
@@ -180,7 +433,7 @@ class BoardWidget:
         for colour in chess.COLORS:
             for piece_type in chess.PIECE_TYPES:
 
-                icon = self.theme['icons'][colour][piece_type]
+                icon = self.icons[colour][piece_type]
 
                 for square in self.board.pieces(piece_type, colour):
 
@@ -195,107 +448,102 @@ class BoardWidget:
 
                     self.icon_tags[square] = self.canvas.create_image(left, top, image=icon)
 
-    def draw_board(self):
-        """Draws the board."""
-
-        self._draw_squares()
-        self._draw_labels()
-        self._draw_pieces()
-
-    def highlight_previous_move(self, move):
-        """Highlights the last move made on the board."""
-
-        for square in (move.from_square, move.to_square):
+    def _square_corner(self, square):
+        """Returns the canvas coordinates of the top left corner of a square."""
 
-            row, col = square // 8, square % 8
-
-            if self.pov == chess.BLACK:
-                row = 7 - row
-                col = 7 - col
-                
-            x0 = col * CELL_WIDTH
-            y0 = (7 - row) * CELL_WIDTH
-            x1 = (col + 1) * CELL_WIDTH
-            y1 = (7 - row + 1) * CELL_WIDTH
-
-            self.highlights.append(self.canvas.create_rectangle(x0, y0, x1, y1, 
-                fill=self.theme['square_highlight_colour'], 
-                outline=self.theme['outline_colour'], 
-                width=self.theme['outline_width']))
-
-    def _highlight_capture_square(self, square):
-        """Highlights a square that a piece can capture on."""
-        
         row, col = square // 8, square % 8
-                
+
         if self.pov == chess.BLACK:
             row = 7 - row
             col = 7 - col
 
-        x0 = col * CELL_WIDTH
-        y0 = (7 - row) * CELL_WIDTH
-        x1 = x0 + CELL_WIDTH // 5
-        y1 = y0
-        x2 = x0
-        y2 = y0 + CELL_WIDTH // 5
-        self.highlights.append(self.canvas.create_polygon([x0, y0, x1, y1, x2, y2], fill=self.theme['capture_square_highlight_colour']))
-
-        x0 = (col + 1) * CELL_WIDTH
-        y0 = (7 - row) * CELL_WIDTH
-        x1 = x0 - CELL_WIDTH // 5
-        y1 = y0
-        x2 = x0
-        y2 = y0 + CELL_WIDTH // 5
-        self.highlights.append(self.canvas.create_polygon([x0, y0, x1, y1, x2, y2], fill=self.theme['capture_square_highlight_colour']))
-
-        x0 = col * CELL_WIDTH
-        y0 = (7 - row + 1) * CELL_WIDTH
-        x1 = x0 + CELL_WIDTH // 5
-        y1 = y0
-        x2 = x0
-        y2 = y0 - CELL_WIDTH // 5
-        self.highlights.append(self.canvas.create_polygon([x0, y0, x1, y1, x2, y2], fill=self.theme['capture_square_highlight_colour']))
-
-        x0 = (col + 1) * CELL_WIDTH
-        y0 = (7 - row + 1) * CELL_WIDTH
-        x1 = x0 - CELL_WIDTH // 5
-        y1 = y0
-        x2 = x0
-        y2 = y0 - CELL_WIDTH // 5
-        self.highlights.append(self.canvas.create_polygon([x0, y0, x1, y1, x2, y2], fill=self.theme['capture_square_highlight_colour']))
-
-    def _highlight_non_capture_square(self, square):
-        """Highlights a square that a piece can move to."""
+        return col * CELL_WIDTH, (7 - row) * CELL_WIDTH
 
-        row, col = square // 8, square % 8
+    def _draw_square_highlights(self):
+        """Draws the hidden highlights that mark the squares of the previous move."""
 
-        if self.pov == chess.BLACK:
-            row = 7 - row
-            col = 7 - col
-                    
-        x0 = col * CELL_WIDTH + (CELL_WIDTH - CELL_WIDTH // 5) // 2
-        y0 = (7 - row) * CELL_WIDTH + (CELL_WIDTH - CELL_WIDTH // 5) // 2
-        x1 = x0 + CELL_WIDTH // 5
-        y1 = y0 + CELL_WIDTH // 5
+        self.square_highlight_tags.clear()
+
+        for square in chess.SQUARES:
+
+            x0, y0 = self._square_corner(square)
+            x1 = x0 + CELL_WIDTH
+            y1 = y0 + CELL_WIDTH
+
+            self.square_highlight_tags[square] = self.canvas.create_rectangle(x0, y0, x1, y1,
+                fill=self.theme['square_highlight_colour'],
+                outline=self.theme['outline_colour'],
+                width=self.theme['outline_width'],
+                state='hidden')
+
+    def _draw_move_markers(self):
+        """Draws the hidden markers of the squares a piece can move or capture on."""
+
+        self.move_marker_tags.clear()
+        self.capture_marker_tags.clear()
+
+        size = CELL_WIDTH // 5
+
+        for square in chess.SQUARES:
 
-        self.highlights.append(self.canvas.create_oval(x0, y0, x1, y1, 
-            fill=self.theme['non_capture_square_highlight_colour'], width=0))
+            left, top = self._square_corner(square)
+            right = left + CELL_WIDTH
+            bottom = top + CELL_WIDTH
+
+            # Moves are marked with a dot in the middle of the square.
+            x0 = left + (CELL_WIDTH - size) // 2
+            y0 = top + (CELL_WIDTH - size) // 2
+            self.move_marker_tags[square] = self.canvas.create_oval(x0, y0, x0 + size, y0 + size,
+                fill=self.theme['non_capture_square_highlight_colour'], width=0, state='hidden')
+
+            # Captures are marked with a triangle in each corner.
+            corners = (
+                (left, top, left + size, top, left, top + size),
+                (right, top, right - size, top, right, top + size),
+                (left, bottom, left + size, bottom, left, bottom - size),
+                (right, bottom, right - size, bottom, right, bottom - size),
+            )
+            self.capture_marker_tags[square] = [
+                self.canvas.create_polygon(corner, fill=self.theme['capture_square_highlight_colour'], state='hidden')
+                for corner in corners
+            ]
+
+    def draw_board(self):
+        """Draws the board."""
+
+        self._draw_squares()
+        self._draw_labels()
+        # Previous move highlights go under the pieces, and move markers over them.
+        self._draw_square_highlights()
+        self._draw_pieces()
+        self._draw_move_markers()
+
+    def _show_highlights(self, *tags):
+        """Shows highlights that were drawn hidden."""
+        for tag in tags:
+            self.canvas.itemconfigure(tag, state='normal')
+        self.highlights.extend(tags)
+
+    def highlight_previous_move(self, move):
+        """Highlights the last move made on the board."""
+        self._show_highlights(self.square_highlight_tags[move.from_square], self.square_highlight_tags[move.to_square])
 
     def highlight_possible_moves(self):
         """Highlights legal moves that can be made on the board."""
 
-        for move in self.board.legal_moves:
+        index = self.move_index
+        captures = index.captures[self.active_square]
 
-            if move.from_square == self.active_square:
-
-                if self.board.is_capture(move):
-                    self._highlight_capture_square(move.to_square)
-                else:
-                    self._highlight_non_capture_square(move.to_square)
+        for square in chess.scan_forward(index.targets[self.active_square]):
+            if captures & (1 << square):
+                self._show_highlights(*self.capture_marker_tags[square])
+            else:
+                self._show_highlights(self.move_marker_tags[square])
 
     def clear_highlights(self):
-        """Removes all highlights on the board."""
-        self.canvas.delete(*self.highlights)
+        """Hides all highlights on the board."""
+        for tag in self.highlights:
+            self.canvas.itemconfigure(tag, state='hidden')
         self.highlights.clear()
 
     def clear_pieces(self):
@@ -317,10 +565,16 @@ class BoardWidget:
 
     def make_move(self, move):
         """Makes a move on the board."""
+        # Pieces still moving from earlier animations jump to where they were going.
+        self.finish_animations()
         self.highlight_previous_move(move)
         self.animate_move(move)
         self.board.push(move)
         self.active_square = None
+        self.move_index = LegalMoveIndex(self.board)
+
+        # Let listeners, such as the engine, respond once the move is drawn.
+        self.canvas.event_generate('<<MoveMade>>', when='tail')
 
         # Check for game end.
         if self.board.is_game_over(claim_draw=True):
@@ -330,6 +584,13 @@ class BoardWidget:
     def mouse_click(self, event):
         """Handler for mouse click events."""
 
+        # Ignore clicks while the board is locked.
+        if self.locked:
+            return
+
+        # Pieces cannot be picked up while they are moving.
+        self.finish_animations()
+
         # Check which square was just clicked on.
         r = 7 - event.y // CELL_WIDTH
         c = event.x // CELL_WIDTH
@@ -339,10 +600,8 @@ class BoardWidget:
             square = 63 - square
 
         # If there is a legal move from that square, set it as active.
-        for move in self.board.legal_moves:
-            if move.from_square == square:
-                self.set_active(square)
-                break
+        if self.move_index.targets[square]:
+            self.set_active(square)
 
     def mouse_drag(self, event):
         """Handler for mouse drag events."""
@@ -370,39 +629,36 @@ class BoardWidget:
             self.clear_highlights()
 
         if self.active_square is not None:
-            
-            for move in self.board.legal_moves:
 
-                # If there is a legal move to that square, make the move.
-                if move.from_square == self.active_square and move.to_square == square:
+            # If there is a legal move to that square, make the move.
+            if self.move_index.is_legal(self.active_square, square):
 
-                    if move.promotion:
-                        promotion = self.get_promotion()
-                    else:
-                        promotion = ''
-                    
-                    # Construct a move object.
-                    uci = chess.SQUARE_NAMES[self.active_square] + chess.SQUARE_NAMES[square] + promotion
-                    move = chess.Move.from_uci(uci)
+                if self.move_index.promotions[self.active_square] & (1 << square):
+                    promotion = self.get_promotion()
+                else:
+                    promotion = ''
 
-                    self.clear_highlights()
+                # Construct a move object.
+                uci = chess.SQUARE_NAMES[self.active_square] + chess.SQUARE_NAMES[square] + promotion
+                move = chess.Move.from_uci(uci)
+
+                self.clear_highlights()
+
+                # Carry out the move.
+                self.make_move(move)
 
-                    # Carry out the move.
-                    self.make_move(move)
-                    break
-            
             # If no legal moves, animate the icon back to its square.
             else:
                 tag = self.icon_tags[self.active_square]
-                self.animate_motion(tag, self.active_square, ILLEGAL_MOVE_REVERSE_ANIMATION_SPEED)
+                self.animate_motion(tag, self.active_square, ILLEGAL_MOVE_REVERSE_ANIMATION_TIME)
 
-    def animate_motion(self, tag, dest, speed):
-        """Animate the movement of an object identified by its tag to a destination square."""
-            
-        # Calculate the source coordinates.
-        src_coords = self.canvas.coords(tag)
-        src_coords[0] -= ICON_WIDTH // 2
-        src_coords[1] -= ICON_WIDTH // 2
+    def animate_motion(self, tag, dest, duration, on_finish=None):
+        """Starts moving an object identified by its tag to a destination square, taking a fixed number of seconds.
+
+        Frames are drawn from the event loop, so several objects can move at once
+        without holding up other events. If given, on_finish is called once the
+        object arrives.
+        """
 
         # Calculate the destination coordinates.
         row, col = dest // 8, dest % 8
@@ -411,30 +667,59 @@ class BoardWidget:
             row = 7 - row
             col = 7 - col
 
-        left = col * CELL_WIDTH + (CELL_WIDTH // 2) - ICON_WIDTH // 2
-        top = (7 - row) * CELL_WIDTH + (CELL_WIDTH // 2) - ICON_WIDTH // 2
-        dest_coords = left, top
-
-        # Calculate the horizontal and vertical distances.
-        delta_x = dest_coords[0] - src_coords[0]
-        delta_y = dest_coords[1] - src_coords[1]
-        # Calculate the straight line distance.
-        distance = (delta_x ** 2 + delta_y ** 2) ** 0.5
-        # Check how many steps it will take to get to the destination.
-        steps = int(distance / speed)
-        
-        # Move the piece.
-        position = src_coords[:]
-        for i in range(steps):
-            x = position[0] + delta_x / steps
-            y = position[1] + delta_y / steps
-            self.canvas.moveto(tag, x, y)
-            position = [x, y]
-            self.root.update_idletasks()
-
-        # Ensure the icon is at the correct position.
-        self.canvas.moveto(tag, *dest_coords)
-        self.root.update_idletasks()
+        x = col * CELL_WIDTH + (CELL_WIDTH // 2)
+        y = (7 - row) * CELL_WIDTH + (CELL_WIDTH // 2)
+
+        # An object that is already moving sets off from wherever it has got to.
+        previous = self.tweens.pop(tag, None)
+        if previous is not None and previous.on_finish is not None:
+            previous.on_finish()
+
+        self.tweens[tag] = Tween(self.canvas.coords(tag), (x, y), duration, on_finish)
+
+        # Start drawing frames, unless other animations are already drawing them.
+        if self._animation_frame is None:
+            self._animation_frame = self.root.after(1000 // ANIMATION_FRAME_RATE, self._animate_frame)
+
+    def _animate_frame(self):
+        """Draws a frame of each animation in progress, and schedules the next frame while any remain."""
+
+        self._animation_frame = None
+        now = time.monotonic()
+
+        for tag, tween in list(self.tweens.items()):
+            (x, y), finished = tween.position(now)
+            self.canvas.coords(tag, x, y)
+
+            if finished:
+                del self.tweens[tag]
+                if tween.on_finish is not None:
+                    tween.on_finish()
+
+        if self.tweens:
+            self._animation_frame = self.root.after(1000 // ANIMATION_FRAME_RATE, self._animate_frame)
+
+    def finish_animations(self):
+        """Cancels the animations in progress, putting each object straight where it was going."""
+
+        if self._animation_frame is not None:
+            self.root.after_cancel(self._animation_frame)
+            self._animation_frame = None
+
+        tweens, self.tweens = self.tweens, {}
+        for tag, tween in tweens.items():
+            self.canvas.coords(tag, *tween.end)
+            if tween.on_finish is not None:
+                tween.on_finish()
+
+    def _remove_captured_icon(self, square):
+        """Removes the icon of a piece captured on a square from the mappings.
+
+        Returns a function that deletes the icon itself, to call once the capturing piece arrives.
+        """
+
+        capture_tag = self.icon_tags.pop(square)
+        return lambda: self.canvas.delete(capture_tag)
 
     def _animate_castling_move(self, move):
         """Animates a castling move."""
@@ -467,8 +752,9 @@ class BoardWidget:
         self.canvas.tag_raise(king_tag)
         self.canvas.tag_raise(rook_tag)
 
-        self.animate_motion(king_tag, king_dest, speed=MOVE_ANIMATION_SPEED)
-        self.animate_motion(rook_tag, rook_dest, speed=MOVE_ANIMATION_SPEED)
+        # The king and rook move at the same time.
+        self.animate_motion(king_tag, king_dest, MOVE_ANIMATION_TIME)
+        self.animate_motion(rook_tag, rook_dest, MOVE_ANIMATION_TIME)
 
         # Update icon mappings.
         del self.icon_tags[king_src]
@@ -482,28 +768,26 @@ class BoardWidget:
         src = move.from_square
         dest = move.to_square
         icon_tag = self.icon_tags[src]
+        promotion_icon = self.icons[self.board.turn][move.promotion]
 
         self.canvas.tag_raise(icon_tag)
 
-        # Move the piece.
-        self.animate_motion(icon_tag, dest, speed=MOVE_ANIMATION_SPEED)
+        # Make captures if necessary.
+        is_capture = self.move_index.captures[src] & (1 << dest)
+        remove_capture = self._remove_captured_icon(dest) if is_capture else None
 
-        # Replace pawn with promoted piece.
-        promotion_icon = self.theme['icons'][self.board.turn][move.promotion]
-        left, top = self.canvas.coords(icon_tag)
-        self.canvas.delete(icon_tag)            
-        promotion_icon_tag = self.canvas.create_image(left, top, image=promotion_icon)
+        # Once the pawn arrives, replace it with the promoted piece.
+        def promote():
+            self.canvas.itemconfigure(icon_tag, image=promotion_icon)
+            if remove_capture is not None:
+                remove_capture()
 
-        # Make captures if necessary.
-        if self.board.is_capture(move):
-            capture_square = dest
-            capture_tag = self.icon_tags[capture_square]
-            self.canvas.delete(capture_tag)
-            del self.icon_tags[capture_square]
+        # Move the piece.
+        self.animate_motion(icon_tag, dest, MOVE_ANIMATION_TIME, on_finish=promote)
 
         # Update icon mappings.
         del self.icon_tags[src]
-        self.icon_tags[dest] = promotion_icon_tag
+        self.icon_tags[dest] = icon_tag
 
     def _animate_regular_move(self, move):
         """Animate a non-castling, non_promotion move."""
@@ -513,13 +797,11 @@ class BoardWidget:
 
         self.canvas.tag_raise(icon_tag)
 
-        # Move the piece.
-        self.animate_motion(icon_tag, dest, speed=MOVE_ANIMATION_SPEED)
-
         # Check for captures.
-        if self.board.is_capture(move):
+        remove_capture = None
+        if self.move_index.captures[src] & (1 << dest):
 
-            if self.board.is_en_passant(move):
+            if self.move_index.en_passant[src] & (1 << dest):
 
                 if self.board.turn == chess.WHITE:
                     capture_square = move.to_square - 8
@@ -529,10 +811,10 @@ class BoardWidget:
             else:
                 capture_square = dest
 
-            # Get the icon tag of the piece to be captured.
-            capture_tag = self.icon_tags[capture_square]
-            self.canvas.delete(capture_tag)
-            del self.icon_tags[capture_square]
+            remove_capture = self._remove_captured_icon(capture_square)
+
+        # Move the piece, removing any captured piece once it arrives.
+        self.animate_motion(icon_tag, dest, MOVE_ANIMATION_TIME, on_finish=remove_capture)
             
         # Update icon mappings.
         del self.icon_tags[src]
@@ -554,6 +836,7 @@ class BoardWidget:
             
     def get_promotion(self):
         
+        import tkinter as tk
         promotion = tk.StringVar()
 
         # Create a new top-level window.
@@ -565,10 +848,10 @@ class BoardWidget:
         frame = tk.Frame(promotion_window, width=CELL_WIDTH * 4, height=CELL_WIDTH * 4)
 
         # Get all icons.
-        frame.rook_icon = self.theme['icons'][self.board.turn][chess.ROOK]
-        frame.knight_icon = self.theme['icons'][self.board.turn][chess.KNIGHT]
-        frame.bishop_icon = self.theme['icons'][self.board.turn][chess.BISHOP]
-        frame.queen_icon = self.theme['icons'][self.board.turn][chess.QUEEN]
+        frame.rook_icon = self.icons[self.board.turn][chess.ROOK]
+        frame.knight_icon = self.icons[self.board.turn][chess.KNIGHT]
+        frame.bishop_icon = self.icons[self.board.turn][chess.BISHOP]
+        frame.queen_icon = self.icons[self.board.turn][chess.QUEEN]
 
         # Make four buttons for each promotion type.
         rook = tk.Button(frame, width=CELL_WIDTH * 2, height=CELL_WIDTH * 2, image=frame.rook_icon, command=lambda: promotion.set('r'))
@@ -592,6 +875,7 @@ class BoardWidget:
 
     def display_result(self, result):
         
+        import tkinter.messagebox
         if result == '1-0':
             tkinter.messagebox.showinfo('Game Over', 'Checkmate! White wins.')
         elif result == '0-1':
@@ -600,7 +884,8 @@ class BoardWidget:
             tkinter.messagebox.showinfo('Game Over', 'Draw')
 
 
-DEFAULT_ICONS = load_icons('resources/images/icons/001')
+# Themes refer to their icons by folder, so they are only loaded once a board is drawn.
+DEFAULT_ICON_PATH = 'resources/images/icons/001'
 
 THEMES = {
     'Green': {
@@ -611,7 +896,7 @@ THEMES = {
         'square_highlight_colour': '#649696',
         'non_capture_square_highlight_colour': '#649696',
         'capture_square_highlight_colour': '#323232',
-        'icons': DEFAULT_ICONS
+        'icon_path': DEFAULT_ICON_PATH
     },
     'Blue': {
         'light_square_colour': '#f0f0ff',
@@ -621,7 +906,7 @@ THEMES = {
         'square_highlight_colour': '#649696',
         'non_capture_square_highlight_colour': '#649696',
         'capture_square_highlight_colour': '#323232',
-        'icons': DEFAULT_ICONS
+        'icon_path': DEFAULT_ICON_PATH
     },
     'Purple': {
         'light_square_colour': '#fff0ff',
@@ -631,7 +916,7 @@ THEMES = {
         'square_highlight_colour': '#649696',
         'non_capture_square_highlight_colour': '#82b4b4',
         'capture_square_highlight_colour': '#649696',
-        'icons': DEFAULT_ICONS
+        'icon_path': DEFAULT_ICON_PATH
     },
     'High Contrast': {
         'light_square_colour': '#ffffff',
@@ -641,13 +926,22 @@ THEMES = {
         'square_highlight_colour': '#cd7400',
         'non_capture_square_highlight_colour': '#cd7400',
         'capture_square_highlight_colour': '#cd7400',
-        'icons': DEFAULT_ICONS
+        'icon_path': DEFAULT_ICON_PATH
     }
 }
 
 
 def main():
     """Starts the application."""
+
+    # Tk is only loaded once there is a window to show, so the module can be imported without it.
+    import tkinter as tk
+
+    # Initialize the root widget.
+    root = tk.Tk()
+    root.geometry(f'{CELL_WIDTH * 8}x{CELL_WIDTH * 8}')
+    root.title('Chess')
+
     gui = GUI(root)
     gui.mainloop()
 
@@ -0,0 +1,268 @@
+import argparse
+import datetime
+import importlib
+import json
+import math
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import chess
+import chess.pgn
+
+from minimax import Agent
+
+# Games longer than this many half-moves are adjudicated as draws.
+MAX_PLIES = 300
+
+
+def load_openings(path):
+    """Returns the positions in an EPD file, or just the starting position if there is no file."""
+
+    if path is None:
+        return [chess.Board()]
+
+    openings = []
+    with open(path) as epd:
+        for line in epd:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                board, _ = chess.Board.from_epd(line)
+                openings.append(board)
+
+    return openings
+
+
+def load_evaluation(name):
+    """Imports an evaluation function given as 'module:function'."""
+    module_name, function_name = name.split(':')
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def build_agent(options):
+    """Creates an agent from its options, importing evaluations given as 'module:function'."""
+
+    options = dict(options)
+    for name in ('custom_evaluation', 'custom_batch_evaluation'):
+        if options.get(name):
+            options[name] = load_evaluation(options[name])
+
+    return Agent(**options)
+
+
+def sprt_bounds(alpha, beta):
+    """Returns the lower and upper log-likelihood ratio bounds of an SPRT."""
+    return math.log(beta / (1 - alpha)), math.log((1 - beta) / alpha)
+
+
+def sprt_llr(wins, draws, losses, elo0, elo1):
+    """Returns the log-likelihood ratio of elo1 against elo0, given game results.
+
+    Uses the normal approximation to the distribution of game scores, as most
+    engine testing frameworks do.
+    """
+
+    games = wins + draws + losses
+    if not games:
+        return 0.0
+
+    score = (wins + draws / 2) / games
+    variance = (wins + draws / 4) / games - score ** 2
+
+    # With every game scoring the same, there is nothing to go on yet.
+    if variance <= 0:
+        return 0.0
+
+    score0 = 1 / (1 + 10 ** (-elo0 / 400))
+    score1 = 1 / (1 + 10 ** (-elo1 / 400))
+
+    return games * (score1 - score0) * (2 * score - score0 - score1) / (2 * variance)
+
+
+def elo_difference(wins, draws, losses):
+    """Returns the Elo difference implied by a score, or None if it is 0% or 100%."""
+
+    games = wins + draws + losses
+    score = (wins + draws / 2) / games if games else 0.5
+    if not 0 < score < 1:
+        return None
+    return -400 * math.log10(1 / score - 1)
+
+
+# The agents of a worker process, and the limits they search with.
+_worker_agents = None
+_worker_limits = None
+
+
+def _initialize_worker(configurations, limits):
+    """Sets up the agents of a worker process from their configurations."""
+
+    global _worker_agents, _worker_limits
+
+    _worker_agents = [build_agent(configuration) for configuration in configurations]
+
+    _worker_limits = limits
+
+
+def _play_game(opening_fen, first_is_white, round_number, names):
+    """Plays one game between the two agents. Returns the score of the first agent and the PGN."""
+
+    board = chess.Board(opening_fen)
+    agents = _worker_agents if first_is_white else _worker_agents[::-1]
+    white, black = names if first_is_white else names[::-1]
+
+    # Start each game from a clean slate, so games do not depend on what ran before in this process.
+    for agent in agents:
+        agent.transposition_table.clear()
+
+    termination = 'normal'
+    while not board.is_game_over(claim_draw=True):
+        if board.ply() >= MAX_PLIES:
+            termination = 'adjudication'
+            break
+
+        agent = agents[0] if board.turn == chess.WHITE else agents[1]
+        move, _ = agent.search(board, **_worker_limits)
+        board.push(move)
+
+    result = board.result(claim_draw=True) if termination == 'normal' else '1/2-1/2'
+
+    game = chess.pgn.Game.from_board(board)
+    game.headers['Event'] = 'Self-play match'
+    game.headers['Date'] = datetime.date.today().strftime('%Y.%m.%d')
+    game.headers['Round'] = str(round_number)
+    game.headers['White'] = white
+    game.headers['Black'] = black
+    game.headers['Result'] = result
+    game.headers['Termination'] = termination
+
+    white_score = {'1-0': 1.0, '0-1': 0.0}.get(result, 0.5)
+    score = white_score if first_is_white else 1 - white_score
+
+    return score, str(game)
+
+
+def run_match(configurations, openings, games, pgn_path=None, workers=1, limits=None, names=('A', 'B'),
+              elo0=0, elo1=5, alpha=0.05, beta=0.05, report=print):
+    """Plays games between two agent configurations, stopping early when the SPRT accepts a hypothesis.
+
+    Each opening is played twice, with colours swapped. Finished games are
+    appended to the PGN file straight away. Returns a summary of the match.
+    """
+
+    limits = limits or {'movetime': 0.1}
+    lower_bound, upper_bound = sprt_bounds(alpha, beta)
+    wins = draws = losses = 0
+    llr = 0.0
+    decision = None
+
+    # Openings are played in order, with the first configuration as white, then black.
+    schedule = [
+        (openings[(game // 2) % len(openings)].fen(), game % 2 == 0, game + 1)
+        for game in range(games)
+    ]
+
+    pgn = open(pgn_path, 'a') if pgn_path else None
+    start = time.monotonic()
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_initialize_worker,
+                             initargs=(configurations, limits)) as pool:
+
+        # Keep a couple of games queued for each worker, so none sit idle.
+        pending = set()
+        next_game = 0
+
+        while next_game < len(schedule) or pending:
+            while next_game < len(schedule) and len(pending) < 2 * workers:
+                pending.add(pool.submit(_play_game, *schedule[next_game], names))
+                next_game += 1
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                score, game_pgn = future.result()
+                if score == 1:
+                    wins += 1
+                elif score == 0:
+                    losses += 1
+                else:
+                    draws += 1
+
+                if pgn is not None:
+                    pgn.write(game_pgn + '\n\n')
+                    pgn.flush()
+
+            played = wins + draws + losses
+            llr = sprt_llr(wins, draws, losses, elo0, elo1)
+            games_per_minute = played / (time.monotonic() - start) * 60
+            report(f'Games: {played}, +{wins} ={draws} -{losses}, LLR: {llr:.2f} '
+                   f'[{lower_bound:.2f}, {upper_bound:.2f}], {games_per_minute:.1f} games/min')
+
+            if llr >= upper_bound:
+                decision = 'H1'
+            elif llr <= lower_bound:
+                decision = 'H0'
+
+            if decision is not None:
+                for future in pending:
+                    future.cancel()
+                break
+
+    if pgn is not None:
+        pgn.close()
+
+    played = wins + draws + losses
+    elapsed = time.monotonic() - start
+
+    return {
+        'games': played,
+        'wins': wins,
+        'draws': draws,
+        'losses': losses,
+        'elo': elo_difference(wins, draws, losses),
+        'llr': llr,
+        'bounds': [lower_bound, upper_bound],
+        'decision': decision,
+        'time': round(elapsed, 2),
+        'games_per_minute': round(played / elapsed * 60, 2),
+    }
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Plays two agent configurations against each other.')
+    parser.add_argument('--first', default='{}', help='Agent options of the first configuration, as JSON')
+    parser.add_argument('--second', default='{}', help='Agent options of the second configuration, as JSON')
+    parser.add_argument('--openings', default='resources/openings.epd', help='EPD file of opening positions')
+    parser.add_argument('--games', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=1, help='number of games played at once')
+    parser.add_argument('--pgn', help='file to append finished games to')
+    parser.add_argument('--movetime', type=float, help='seconds per move')
+    parser.add_argument('--depth', type=int, help='depth per move')
+    parser.add_argument('--nodes', type=int, help='nodes per move')
+    parser.add_argument('--elo0', type=float, default=0)
+    parser.add_argument('--elo1', type=float, default=5)
+    parser.add_argument('--alpha', type=float, default=0.05)
+    parser.add_argument('--beta', type=float, default=0.05)
+
+    args = parser.parse_args()
+
+    limits = {}
+    if args.movetime is not None:
+        limits['movetime'] = args.movetime
+    if args.depth is not None:
+        limits['max_depth'] = args.depth
+    if args.nodes is not None:
+        limits['max_nodes'] = args.nodes
+
+    # Options such as custom_evaluation are given as 'module:function'.
+    configurations = [json.loads(args.first), json.loads(args.second)]
+
+    summary = run_match(
+        configurations, load_openings(args.openings), args.games, args.pgn, args.workers, limits or None,
+        elo0=args.elo0, elo1=args.elo1, alpha=args.alpha, beta=args.beta,
+    )
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,71 +1,1116 @@
+import multiprocessing
 import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 
 import chess
+import chess.polyglot
+
+from bitbase import DRAW, Bitbases
+from book import OpeningBook
+from evaluation import (PIECE_VALUES, EvaluationCache, evaluate_activity, evaluate_batch, evaluate_board,
+                        evaluate_pawns, taper)
+from position import Position
+from transposition import TranspositionTable, EXACT, LOWER_BOUND, UPPER_BOUND, decode_move
+
+# Evaluations at or beyond this magnitude are forced mates.
+MATE_EVALUATION = 1_000_000
+
+# Wins known from the bitbases score below mates, less the distance to mate.
+BITBASE_EVALUATION = 900_000
+
+# The deepest ply that killer moves are kept for.
+MAX_PLY = 128
+
+# Move ordering scores for each class of move. Quiet moves are scored by their history.
+HASH_MOVE_SCORE = 10_000_000
+CAPTURE_SCORE = 1_000_000
+PROMOTION_SCORE = 900_000
+KILLER_MOVE_SCORES = (800_000, 799_999)
+
+# Captures that cannot raise the evaluation to within this margin of alpha (or beta) are skipped.
+DELTA_MARGIN = 200
+
+# Null move pruning searches the position after passing this many plies less deeply, from this depth on.
+NULL_MOVE_REDUCTION = 2
+NULL_MOVE_MIN_DEPTH = 3
+
+# Late move reductions search quiet moves after the first few this many plies less deeply, from this depth on.
+LMR_MOVES = 3
+LMR_REDUCTION = 1
+LMR_MIN_DEPTH = 3
+
+# Futility pruning margins by remaining depth. Depth 0 is left to the quiescence search.
+FUTILITY_MARGINS = (0, 200, 500)
+
+# Aspiration windows start this far either side of the previous iteration's score, from this depth on.
+# After each fail-low or fail-high the window grows by the given factor, up to the limit.
+ASPIRATION_WINDOW = 50
+ASPIRATION_MIN_DEPTH = 4
+ASPIRATION_GROWTH = 4
+ASPIRATION_LIMIT = 1000
+
+# Entries in the caches of static evaluations and pawn structure scores.
+EVALUATION_CACHE_SIZE = 1 << 16
+PAWN_CACHE_SIZE = 1 << 14
+
+# Nodes between calls of a search's progress callback.
+PROGRESS_INTERVAL = 10_000
+
+
+class SearchAborted(Exception):
+    """Raised inside the search when its time or node budget runs out."""
+
+
+class SearchStats:
+    """Counters describing one search, to explain where its time went."""
+
+    def __init__(self):
+        self.start_time = time.monotonic()
+        self.elapsed = 0.0
+        self.depth = 0
+
+        self.nodes = 0
+        self.quiescence_nodes = 0
+        self.leaf_evaluations = 0
+        self.beta_cutoffs = 0
+        self.first_move_cutoffs = 0
+
+        # How often each kind of selective search kicked in.
+        self.null_move_cutoffs = 0
+        self.reduced_moves = 0
+        self.reduced_move_researches = 0
+        self.futile_moves = 0
+
+        # How often a null window or an aspiration window was too narrow, so a move or the root was searched again.
+        self.pvs_researches = 0
+        self.aspiration_researches = 0
+
+        self.hash_probes = 0
+        self.hash_hits = 0
+
+        # The depth, evaluation, nodes and time of each completed iteration.
+        self.iterations = []
+
+    def update(self, agent):
+        """Copies the counters kept elsewhere by the agent and its transposition table."""
+
+        self.elapsed = time.monotonic() - self.start_time
+        self.nodes = agent.nodes
+        self.hash_probes = agent.transposition_table.probes
+        self.hash_hits = agent.transposition_table.hits
+
+    def add_iteration(self, depth, evaluation):
+        """Records a completed iteration."""
+
+        nodes = self.nodes - sum(iteration['nodes'] for iteration in self.iterations)
+        time_spent = self.elapsed - sum(iteration['time'] for iteration in self.iterations)
+
+        self.iterations.append({'depth': depth, 'evaluation': evaluation, 'nodes': nodes, 'time': time_spent})
+
+    @property
+    def first_move_cutoff_rate(self):
+        """Returns the fraction of beta cut-offs caused by the first move searched."""
+        return self.first_move_cutoffs / self.beta_cutoffs if self.beta_cutoffs else None
+
+    @property
+    def effective_branching_factor(self):
+        """Returns how many times more nodes the last iteration took than the one before."""
+        if len(self.iterations) < 2 or not self.iterations[-2]['nodes']:
+            return None
+        return self.iterations[-1]['nodes'] / self.iterations[-2]['nodes']
+
+    @property
+    def hash_hit_rate(self):
+        """Returns the fraction of transposition table probes that found an entry."""
+        return self.hash_hits / self.hash_probes if self.hash_probes else None
+
+    @property
+    def nps(self):
+        """Returns the nodes searched per second."""
+        return self.nodes / self.elapsed if self.elapsed else 0
+
+    def as_dict(self):
+        """Returns the statistics as a dictionary, for logging or serialisation."""
+        return {
+            'depth': self.depth,
+            'time': self.elapsed,
+            'nodes': self.nodes,
+            'nps': self.nps,
+            'quiescence_nodes': self.quiescence_nodes,
+            'leaf_evaluations': self.leaf_evaluations,
+            'beta_cutoffs': self.beta_cutoffs,
+            'first_move_cutoff_rate': self.first_move_cutoff_rate,
+            'effective_branching_factor': self.effective_branching_factor,
+            'null_move_cutoffs': self.null_move_cutoffs,
+            'reduced_moves': self.reduced_moves,
+            'reduced_move_researches': self.reduced_move_researches,
+            'futile_moves': self.futile_moves,
+            'pvs_researches': self.pvs_researches,
+            'aspiration_researches': self.aspiration_researches,
+            'hash_probes': self.hash_probes,
+            'hash_hits': self.hash_hits,
+            'hash_hit_rate': self.hash_hit_rate,
+            'iterations': self.iterations,
+        }
+
 
 class Agent:
 
-    def __init__(self, custom_evaluation=None):
+    def __init__(self, custom_evaluation=None, hash_size_mb=16, move_ordering=True,
+                 quiescence_search=True, delta_margin=DELTA_MARGIN, quiescence_check_limit=1,
+                 debug_evaluation=False, workers=1, book_path=None, bitbase_path=None,
+                 custom_batch_evaluation=None, null_move_pruning=True, late_move_reductions=True,
+                 futility_pruning=True, hash_path=None, warm_start=True):
+
+        # Helper processes are set up with the same options.
+        self._options = dict(
+            custom_evaluation=custom_evaluation,
+            custom_batch_evaluation=custom_batch_evaluation,
+            move_ordering=move_ordering,
+            quiescence_search=quiescence_search,
+            delta_margin=delta_margin,
+            quiescence_check_limit=quiescence_check_limit,
+            bitbase_path=bitbase_path,
+            null_move_pruning=null_move_pruning,
+            late_move_reductions=late_move_reductions,
+            futility_pruning=futility_pruning,
+        )
+
         if custom_evaluation:
             self.calculate_static_evaluation = custom_evaluation
 
-    def minimax(self, board, depth, alpha, beta, is_maximizer):
+        # A batch evaluation scores a list of boards at once. Without a single-board variant, it scores single boards too.
+        if custom_batch_evaluation:
+            self.calculate_batch_evaluation = custom_batch_evaluation
+            if not custom_evaluation:
+                self.calculate_static_evaluation = self._evaluate_single_board
 
-        # At terminal nodes, return a static evaluation.
-        if depth == 0 or board.is_game_over(claim_draw=True):
-            return None, self.calculate_static_evaluation(board)
+        # The search runs on a Position, which keeps the built-in evaluation up to date as moves are made.
+        # Custom evaluations are given a chess.Board replayed from the root board instead.
+        self.custom_evaluation = custom_evaluation or custom_batch_evaluation
+        self.batch_leaves = bool(custom_batch_evaluation)
+        self.debug_evaluation = debug_evaluation
+        self._search_board = None
+        self._search_board_moves = []
 
-        # Start by picking a random best move.
-        best_move = random.choice(list(board.legal_moves))
+        # Static evaluations by Zobrist key, and pawn structure scores by the key of the pawns alone.
+        self.evaluation_cache = EvaluationCache(EVALUATION_CACHE_SIZE)
+        self.pawn_cache = EvaluationCache(PAWN_CACHE_SIZE)
+
+        # Zobrist hashes of the positions leading up to the current node, for spotting repetitions.
+        self._hash_stack = []
+
+        # With several workers, the table is shared with the helper processes. Given a path, the table is
+        # kept in a file instead, so that it persists between runs and can be shared by several engines.
+        # With warm_start, results already in the file are reused, so positions searched before are
+        # answered from it.
+        self.workers = workers
+        self.transposition_table = TranspositionTable(hash_size_mb, shared=workers > 1, path=hash_path,
+                                                      warm_start=warm_start)
+        self._pool = None
+        self._helper_stop_event = None
+
+        # Book moves are played without searching.
+        self.book = OpeningBook(book_path) if book_path else None
+
+        # Endgames covered by the bitbases (a directory of tables) are looked up instead of searched.
+        self.bitbases = Bitbases(bitbase_path) if bitbase_path else None
+
+        self.move_ordering = move_ordering
+        self.quiescence_search = quiescence_search
+        self.delta_margin = delta_margin
+        self.quiescence_check_limit = quiescence_check_limit
+        self.clear_move_ordering_tables()
+
+        # Selective search, which skips or shortens the search of moves that are unlikely to matter.
+        self.null_move_pruning = null_move_pruning
+        self.late_move_reductions = late_move_reductions
+        self.futility_pruning = futility_pruning
+
+        self.nodes = 0
+        self.depth = 0
+        self.principal_variation = []
+        self._deadline = None
+        self._max_nodes = None
+        self._stop_event = None
+        self._on_iteration = None
+        self._on_progress = None
+        self._progress_interval = PROGRESS_INTERVAL
+        self._next_progress = None
+        self._limits_active = False
+        self.stats = SearchStats()
+
+        # Pondering searches wait for ponderhit before their time budget starts. A search can be armed to
+        # ponder before its thread starts, so that a ponderhit arriving in between is kept.
+        self._pondering = False
+        self._ponder_armed = False
+        self._ponderhit_movetime = None
+        self._ponder_lock = threading.Lock()
+        self._ponderhit_event = threading.Event()
+        self._search_start = None
+        self._movetime = None
+
+    def search(self, board, movetime=None, max_depth=None, max_nodes=None, stop_event=None, ponder=False,
+               on_iteration=None, on_progress=None, progress_interval=PROGRESS_INTERVAL):
+        """Searches with iterative deepening until a time (in seconds), depth or node budget runs out.
+
+        The search can also be cancelled from another thread by setting stop_event.
+        With ponder set, the board should be the position after the opponent's
+        expected move. The search then runs without a time budget, and does not
+        return until ponderhit is called or it is stopped. When the search runs on
+        another thread, call begin_ponder before starting it.
+        With several workers, helper processes search the same position alongside
+        this one (Lazy SMP), and the node budget only counts this process's nodes.
+        If given, on_iteration is called with the depth, evaluation and principal
+        variation after every completed iteration, and on_progress is called with
+        the search's stats every progress_interval nodes.
+        Statistics of the search are left in self.stats.
+        Returns the best move and evaluation of the deepest completed iteration.
+        """
+
+        self._start_search(movetime, max_nodes, stop_event, ponder, on_iteration, on_progress, progress_interval)
+        self.transposition_table.new_search()
+
+        # Search on a copy, so an aborted iteration cannot leave moves on the board.
+        board = board.copy()
+
+        # There is nothing to search with only one legal move, or with a book move.
+        moves = list(board.legal_moves)
+        book_move = self.book.choose_move(board) if self.book is not None else None
+
+        # Failing those, endgames in the bitbases are known exactly. Probing them looks up every child position.
+        bitbase_move = None
+        if len(moves) > 1 and book_move is None and self.bitbases is not None:
+            bitbase_move = self.bitbases.best_move(board)
+
+        if len(moves) == 1 or book_move is not None:
+            best_move, best_evaluation = book_move or moves[0], self.calculate_static_evaluation(board)
+            self.principal_variation = [best_move]
+            helpers = []
+        elif bitbase_move is not None:
+            best_move, result = bitbase_move
+            best_evaluation = self._bitbase_evaluation(board, result, 0)
+            self.principal_variation = [best_move]
+            helpers = []
+        else:
+            helpers = self._start_helpers(board, max_depth) if self.workers > 1 else []
+            best_move, best_evaluation = self._iterative_deepening(board, max_depth)
+
+        # A pondering search may run out of depth early, but must still wait for the opponent's move.
+        while self._pondering and not (stop_event is not None and stop_event.is_set()):
+            self._ponderhit_event.wait(0.005)
+
+        if helpers:
+            best_move, best_evaluation = self._finish_helpers(helpers, board, best_move, best_evaluation)
+
+        self.stats.update(self)
+
+        return best_move, best_evaluation
+
+    def _start_search(self, movetime=None, max_nodes=None, stop_event=None, ponder=False, on_iteration=None,
+                      on_progress=None, progress_interval=PROGRESS_INTERVAL):
+        """Resets the budget, counters and move ordering tables for a new search."""
+
+        with self._ponder_lock:
+            if ponder and self._ponder_armed and self._ponderhit_event.is_set():
+                # The expected move was played before the search began, so it runs as a normal search.
+                ponder = False
+                if self._ponderhit_movetime is not None:
+                    movetime = self._ponderhit_movetime
+            elif not (ponder and self._ponder_armed):
+                self._ponderhit_event.clear()
+
+            start = time.monotonic()
+            self._search_start = start
+            self._movetime = movetime
+            self._ponder_armed = False
+            self._pondering = ponder
+            self._deadline = start + movetime if movetime is not None and not ponder else None
+
+        self._max_nodes = max_nodes
+        self._stop_event = stop_event
+        self._on_iteration = on_iteration
+        self._on_progress = on_progress
+        self._progress_interval = progress_interval
+        self._next_progress = progress_interval if on_progress is not None else None
+        self.nodes = 0
+        self.depth = 0
+        self.principal_variation = []
+        self.clear_move_ordering_tables()
+        self.transposition_table.reset_counters()
+        self.stats = SearchStats()
+
+    def _iterative_deepening(self, board, max_depth=None, first_depth=1):
+        """Searches one ply deeper at a time, returning the result of the deepest completed iteration."""
+
+        best_move, best_evaluation = None, None
+        score = None
+        depth = first_depth - 1
+
+        while max_depth is None or depth < max_depth:
+            depth += 1
+
+            # The first iteration always completes, so there is always a move to return.
+            self._limits_active = depth > first_depth
+
+            try:
+                move, score = self._aspiration_search(board, depth, score)
+            except SearchAborted:
+                break
+
+            evaluation = score if board.turn == chess.WHITE else -score
+
+            best_move, best_evaluation = move, evaluation
+            self.depth = depth
+            self.principal_variation = self.get_principal_variation(board, depth)
+
+            self.stats.depth = depth
+            self.stats.update(self)
+            self.stats.add_iteration(depth, evaluation)
+
+            if self._on_iteration is not None:
+                self._on_iteration(depth, evaluation, self.principal_variation)
+
+            # Stop once a forced mate is found, or when another iteration is unlikely to finish.
+            if abs(evaluation) >= MATE_EVALUATION:
+                break
+            if self._deadline is not None and time.monotonic() >= self._deadline:
+                break
+            if self._stop_event is not None and self._stop_event.is_set():
+                break
+
+        self._limits_active = False
+
+        return best_move, best_evaluation
+
+    def _aspiration_search(self, board, depth, previous_score=None):
+        """Searches a board in a window around the previous iteration's score, widening it until the score falls inside.
+
+        A narrow window cuts off more of the tree, and iterations rarely change the
+        score by much. Returns the best move and its evaluation from the side to
+        move's point of view.
+        """
+
+        # Early iterations are cheap, and forced wins swing the score too far for a window to help.
+        if previous_score is None or depth < ASPIRATION_MIN_DEPTH or abs(previous_score) >= BITBASE_EVALUATION - 1000:
+            return self.negamax(board, depth, float('-inf'), float('+inf'))
+
+        window = ASPIRATION_WINDOW
+        alpha, beta = previous_score - window, previous_score + window
+
+        while True:
+            move, score = self.negamax(board, depth, alpha, beta)
+            if alpha < score < beta:
+                return move, score
+
+            # Widen the side the score fell out of, giving up on it once the window is too wide.
+            self.stats.aspiration_researches += 1
+            window *= ASPIRATION_GROWTH
+            give_up = window > ASPIRATION_LIMIT or abs(score) >= BITBASE_EVALUATION - 1000
+
+            if score <= alpha:
+                alpha = float('-inf') if give_up else score - window
+            else:
+                beta = float('+inf') if give_up else score + window
+
+    def _start_helpers(self, board, max_depth):
+        """Starts helper processes searching the same position, sharing the transposition table."""
+
+        if self._pool is None:
+            context = multiprocessing.get_context()
+            self._helper_stop_event = context.Event()
+
+            # Helpers map the same file as this process, or attach to the same shared memory.
+            table = self.transposition_table
+            table_name = table.shared_memory.name if table.path is None else None
+
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers - 1,
+                mp_context=context,
+                initializer=_initialize_helper,
+                initargs=(table_name, table.path, self._options, self._helper_stop_event),
+            )
+
+        self._helper_stop_event.clear()
+        generation = self.transposition_table.generation
+
+        # Half of the helpers start one ply deeper, so they fill in the table ahead of the rest.
+        return [
+            self._pool.submit(_helper_search, board, max_depth, 1 + helper % 2, generation)
+            for helper in range(1, self.workers)
+        ]
+
+    def _finish_helpers(self, helpers, board, best_move, best_evaluation):
+        """Stops the helpers, and returns the result of the deepest search among them and this one."""
+
+        self._helper_stop_event.set()
+
+        for helper in helpers:
+            move, evaluation, depth, nodes = helper.result()
+            self.nodes += nodes
+
+            # Prefer deeper results, since the helpers may not have been stopped by depth.
+            if move is not None and depth > self.depth:
+                best_move, best_evaluation = move, evaluation
+                self.depth = depth
+                self.principal_variation = self.get_principal_variation(board, depth)
+
+        return best_move, best_evaluation
+
+    def close(self):
+        """Shuts down helper processes and releases shared memory."""
+
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+        self.transposition_table.close()
+
+        if self.book is not None:
+            self.book.close()
+
+        if self.bitbases is not None:
+            self.bitbases.close()
+
+    def begin_ponder(self):
+        """Arms a pondering search that is about to be started on another thread.
+
+        A ponderhit that arrives before the search has begun is then kept, and the
+        search runs with its time budget from the start.
+        """
+
+        with self._ponder_lock:
+            self._ponder_armed = True
+            self._pondering = True
+            self._ponderhit_movetime = None
+            self._ponderhit_event.clear()
+
+    def ponderhit(self, movetime=None):
+        """Tells a pondering search that the expected move was played, so it should start its time budget.
+
+        By default the search gets whatever is left of its original movetime after
+        the time spent pondering, and returns straight away if none is left.
+        Otherwise it gets movetime more seconds from now.
+        """
+
+        with self._ponder_lock:
+            # An armed search that has not begun yet picks the ponderhit up when it starts.
+            if self._ponder_armed:
+                self._ponderhit_movetime = movetime
+            elif movetime is not None:
+                self._deadline = time.monotonic() + movetime
+            elif self._movetime is not None:
+                self._deadline = self._search_start + self._movetime
+
+            self._pondering = False
+            self._ponderhit_event.set()
+
+    def get_principal_variation(self, board, depth):
+        """Follows best moves in the transposition table to get the expected line of play."""
+
+        line = []
+        board = board.copy(stack=False)
+
+        while len(line) < depth:
+            entry = self.transposition_table.probe(chess.polyglot.zobrist_hash(board))
+            move = decode_move(entry[3]) if entry is not None else None
+            if move is None or not board.is_legal(move):
+                break
+            line.append(move)
+            board.push(move)
+
+        return line
+
+    def clear_move_ordering_tables(self):
+        """Forgets the killer moves and history scores of earlier searches."""
+        self.killer_moves = [[0, 0] for _ in range(MAX_PLY)]
+        self.history_scores = [0] * (2 * 64 * 64)
+
+    def order_moves(self, position, moves, hash_move=0, ply=0):
+        """Sorts moves so that the ones most likely to cause a cut-off are searched first."""
+
+        if not self.move_ordering:
+            # Only search the move from earlier searches first.
+            if hash_move:
+                moves.remove(hash_move)
+                moves.insert(0, hash_move)
+            return moves
+
+        killers = self.killer_moves[ply] if ply < MAX_PLY else (0, 0)
+        history_offset = position.turn << 12
+        squares = position.squares
+        ep_square = position.ep_square
+        scores = {}
+
+        for move in moves:
+
+            to_square = (move >> 6) & 0x3f
+            victim = squares[to_square] & 7
+            attacker = squares[move & 0x3f] & 7
+            promotion = move >> 12
+            if attacker == chess.PAWN and to_square == ep_square:
+                victim = chess.PAWN
+
+            if move == hash_move:
+                score = HASH_MOVE_SCORE
+
+            # Order captures by most valuable victim, then least valuable attacker.
+            elif victim:
+                score = CAPTURE_SCORE + 10 * victim - attacker + promotion
+
+            elif promotion:
+                score = PROMOTION_SCORE + promotion
+
+            elif move == killers[0]:
+                score = KILLER_MOVE_SCORES[0]
+            elif move == killers[1]:
+                score = KILLER_MOVE_SCORES[1]
+
+            else:
+                score = self.history_scores[history_offset | move & 0xfff]
+
+            scores[move] = score
+
+        moves.sort(key=scores.__getitem__, reverse=True)
+        return moves
+
+    def _update_move_ordering_tables(self, position, move, depth, ply):
+        """Remembers a quiet move that caused a cut-off."""
+
+        if move >> 12 or position.is_capture(move):
+            return
+
+        if ply < MAX_PLY:
+            killers = self.killer_moves[ply]
+            if move != killers[0]:
+                killers[1] = killers[0]
+                killers[0] = move
+
+        # Deeper cut-offs save more work, so weigh them more.
+        index = position.turn << 12 | move & 0xfff
+        self.history_scores[index] = min(self.history_scores[index] + depth * depth, KILLER_MOVE_SCORES[1] - 1)
+
+    def _count_cutoff(self, move, moves):
+        """Counts a beta cut-off, and whether move ordering put the refuting move first."""
+        self.stats.beta_cutoffs += 1
+        if move == moves[0]:
+            self.stats.first_move_cutoffs += 1
+
+    def _report_progress(self):
+        """Passes up-to-date stats to the progress callback."""
+        self._next_progress += self._progress_interval
+        self.stats.update(self)
+        self._on_progress(self.stats)
+
+    def _check_limits(self):
+        """Aborts the search if its budget has run out."""
+
+        if self._max_nodes is not None and self.nodes >= self._max_nodes:
+            raise SearchAborted()
+
+        # Reading the clock at every node is wasteful, so only check it periodically.
+        if self.nodes & 31:
+            return
+
+        if self._deadline is not None and time.monotonic() >= self._deadline:
+            raise SearchAborted()
+
+        if self._stop_event is not None and self._stop_event.is_set():
+            raise SearchAborted()
+
+    def negamax(self, board, depth, alpha, beta, ply=0):
+        """Searches a board to the given depth. Returns the best move and its evaluation from the side to move's point of view."""
+
+        self._search_board = board.copy()
+        self._search_board_moves = []
+        self._reset_hash_stack(board)
+
+        move, evaluation = self._negamax(Position(board), depth, alpha, beta, ply)
+        return decode_move(move), evaluation
+
+    def minimax(self, board, depth, alpha, beta, is_maximizer, ply=0):
+        """Searches a board to the given depth. Returns the best move and its evaluation from white's point of view.
+
+        The maximizer must be the side to move. The window and evaluation are
+        converted to and from the side to move's point of view for negamax.
+        """
 
         if is_maximizer:
-            max_eval = float('-inf')
-            for move in board.legal_moves:
-
-                # Make the move.
-                board.push(move)
-                # Evaluate the board.
-                evaluation = self.minimax(board, depth-1, alpha, beta, False)[1]
-                # Unmake the move.
-                board.pop()
-
-                # Update the best move.
-                if evaluation > max_eval:
-                    best_move = move
-                # Update the best evaluation.
-                max_eval = max(evaluation, max_eval)
-                # Update alpha.
-                alpha = max(alpha, evaluation)
-
-                # Check for cut-offs.
+            return self.negamax(board, depth, alpha, beta, ply)
+
+        move, evaluation = self.negamax(board, depth, -beta, -alpha, ply)
+        return move, -evaluation
+
+    def _negamax(self, position, depth, alpha, beta, ply, static_evaluation=None):
+
+        self.nodes += 1
+        if self._limits_active:
+            self._check_limits()
+        if self.nodes == self._next_progress:
+            self._report_progress()
+
+        key = position.key
+
+        # Scores are from the side to move's point of view, but evaluations are from white's.
+        sign = 1 if position.turn == chess.WHITE else -1
+
+        # Draws take precedence over everything but checkmate. A draw that could only be claimed does not
+        # end the game, so the root is still searched for a move.
+        if ply and self._is_draw(position, key) and not position.is_checkmate():
+            return 0, sign * self._evaluate_terminal(position, 0)
+
+        # Endgames in the bitbases are known exactly.
+        if ply and self.bitbases is not None and chess.popcount(position.occupied) <= self.bitbases.max_pieces:
+            result = self.bitbases.probe(position.to_board())
+            if result is not None:
+                return 0, sign * self._bitbase_evaluation(position, result, ply)
+
+        # At the horizon, settle pending captures before evaluating.
+        if depth == 0:
+            if self.quiescence_search:
+                return 0, self._quiescence(position, alpha, beta, ply, static_evaluation=static_evaluation)
+            if not position.has_legal_moves():
+                return 0, sign * self._evaluate_terminal(position, self._mate_or_stalemate_evaluation(position))
+            if static_evaluation is not None:
+                return 0, static_evaluation
+            return 0, sign * self._evaluate(position)
+
+        moves = position.legal_moves()
+
+        # Look up the position in the transposition table.
+        original_alpha, original_beta = alpha, beta
+        entry = self.transposition_table.probe(key)
+        hash_move = 0
+
+        if entry is not None:
+            entry_depth, entry_score, bound, hash_move = entry
+
+            # Guard against hash collisions.
+            if hash_move and hash_move not in moves:
+                hash_move = 0
+
+            # Only reuse results from searches at least as deep as this one. At the root the entry may come
+            # from another game, which did not share this one's move history, so it only orders the moves.
+            if ply and entry_depth >= depth and hash_move:
+                if bound == EXACT:
+                    return hash_move, entry_score
+                elif bound == LOWER_BOUND:
+                    alpha = max(alpha, entry_score)
+                elif bound == UPPER_BOUND:
+                    beta = min(beta, entry_score)
+
                 if beta <= alpha:
-                    break
+                    return hash_move, entry_score
+
+        in_check = position.is_check()
+
+        # Null move pruning: if the side to move could pass and still reach beta, a real move would
+        # do at least as well. Passing is worse than any move except in zugzwang, which is common in
+        # pawn endings, so only try it with pieces on the board.
+        if (self.null_move_pruning and ply and depth >= NULL_MOVE_MIN_DEPTH and not in_check
+                and position.last_move() and self._has_pieces(position) and abs(beta) < BITBASE_EVALUATION
+                and sign * self._evaluate(position) >= beta):
+            position.push_null()
+            evaluation = -self._negamax(position, max(0, depth - 1 - NULL_MOVE_REDUCTION), -beta, 1 - beta, ply+1)[1]
+            position.pop()
+            if evaluation >= beta:
+                self.stats.null_move_cutoffs += 1
+                return 0, beta
+
+        # Order moves so that cut-offs are found early. The best move from
+        # earlier searches goes first, so the previous principal variation is tried first.
+        moves = self.order_moves(position, moves, hash_move, ply)
+
+        # Checkmate and stalemate fall out of having no legal moves.
+        if not moves:
+            return 0, sign * self._evaluate_terminal(position, self._mate_or_stalemate_evaluation(position))
+
+        # Evaluate the leaves below a frontier node together, so that batch evaluations can vectorize.
+        static_evaluations = {}
+        if depth == 1 and self.batch_leaves:
+            static_evaluations = self._evaluate_children(position, moves)
+
+        # Futility pruning: near the leaves, quiet moves cannot make up a large deficit, so their
+        # evaluation is at most the static evaluation plus a margin.
+        futility_evaluation = None
+        if (self.futility_pruning and depth < len(FUTILITY_MARGINS) and not in_check
+                and abs(alpha) < BITBASE_EVALUATION and abs(beta) < BITBASE_EVALUATION):
+            evaluation = sign * self._evaluate(position) + FUTILITY_MARGINS[depth]
+            if evaluation <= alpha:
+                futility_evaluation = evaluation
+
+        # Late moves are reduced, as move ordering makes it unlikely that they are best. Every root move
+        # is searched fully, as are killer moves.
+        reduce_late_moves = self.late_move_reductions and ply and depth >= LMR_MIN_DEPTH and not in_check
+        killers = self.killer_moves[ply] if ply < MAX_PLY else (0, 0)
+
+        # Start by picking a random best move.
+        best_move = random.choice(moves)
+        best_evaluation = float('-inf')
+
+        self._hash_stack.append(key)
+
+        for index, move in enumerate(moves):
+            quiet = not move >> 12 and not position.is_capture(move)
+
+            # Make the move.
+            position.push(move)
+
+            # Skip quiet moves that cannot raise the evaluation to alpha, unless they give check.
+            if index and quiet and futility_evaluation is not None and not position.is_check():
+                position.pop()
+                best_evaluation = max(futility_evaluation, best_evaluation)
+                self.stats.futile_moves += 1
+                continue
 
-            return (best_move, max_eval)
-        
+            # Evaluate the board. Move ordering makes the first move the likeliest to be best, so it is
+            # searched with the full window. The rest only need to be shown to be no better than alpha,
+            # which a null window does more cheaply. Moves that turn out better are searched again.
+            if index == 0:
+                evaluation = -self._negamax(position, depth-1, -beta, -alpha, ply+1, static_evaluations.get(move))[1]
+            else:
+                # Late quiet moves are searched less deeply first, and only searched fully if they raise alpha.
+                reduction = 0
+                if (index >= LMR_MOVES and quiet and reduce_late_moves and move not in killers
+                        and not position.is_check()):
+                    reduction = LMR_REDUCTION
+                    self.stats.reduced_moves += 1
+
+                evaluation = -self._negamax(position, depth-1-reduction, -alpha-1, -alpha, ply+1, static_evaluations.get(move))[1]
+                if reduction and evaluation > alpha:
+                    self.stats.reduced_move_researches += 1
+                    evaluation = -self._negamax(position, depth-1, -alpha-1, -alpha, ply+1)[1]
+                if alpha < evaluation < beta:
+                    self.stats.pvs_researches += 1
+                    evaluation = -self._negamax(position, depth-1, -beta, -alpha, ply+1, static_evaluations.get(move))[1]
+
+            # Unmake the move.
+            position.pop()
+
+            # Update the best move and evaluation.
+            if evaluation > best_evaluation:
+                best_move = move
+                best_evaluation = evaluation
+            # Update alpha.
+            alpha = max(alpha, evaluation)
+
+            # Check for cut-offs.
+            if alpha >= beta:
+                self._update_move_ordering_tables(position, move, depth, ply)
+                self._count_cutoff(move, moves)
+                break
+
+        self._hash_stack.pop()
+        self._store(key, depth, best_evaluation, original_alpha, original_beta, best_move)
+        return best_move, best_evaluation
+
+    def quiescence(self, board, alpha, beta, is_maximizer, ply=0, checks=None):
+        """Searches captures and promotions until the position is quiet, then returns its evaluation.
+
+        The side to move may always stand pat on the static evaluation instead of
+        capturing. While in check, all evasions are searched instead, for at most
+        quiescence_check_limit checks along a line. The window and evaluation are
+        from white's point of view, and the maximizer must be the side to move.
+        """
+
+        self._search_board = board.copy()
+        self._search_board_moves = []
+        self._reset_hash_stack(board)
+
+        if is_maximizer:
+            return self._quiescence(Position(board), alpha, beta, ply, checks)
+
+        return -self._quiescence(Position(board), -beta, -alpha, ply, checks)
+
+    def _quiescence(self, position, alpha, beta, ply, checks=None, static_evaluation=None):
+
+        self.nodes += 1
+        self.stats.quiescence_nodes += 1
+        if self._limits_active:
+            self._check_limits()
+        if self.nodes == self._next_progress:
+            self._report_progress()
+
+        # Scores are from the side to move's point of view, but evaluations are from white's.
+        sign = 1 if position.turn == chess.WHITE else -1
+
+        # Captures reset the fifty-move counter and cannot repeat a position, so
+        # only quiet check evasions can lead to a draw by the fifty-move rule or
+        # repetition. The root of the quiescence search was checked by negamax.
+        if checks is not None and position.halfmove_clock >= 7:
+            if self._is_draw(position, position.key):
+                return sign * self._evaluate_terminal(position, 0)
+        elif position.is_insufficient_material():
+            return sign * self._evaluate_terminal(position, 0)
+
+        if checks is None:
+            checks = self.quiescence_check_limit
+
+        in_check = position.is_check()
+
+        if in_check:
+            check_evasions = position.legal_moves()
+            if not check_evasions:
+                return sign * self._evaluate_terminal(position, self._mate_or_stalemate_evaluation(position))
+        elif not position.has_legal_moves():
+            return sign * self._evaluate_terminal(position, 0)
+
+        # When in check, standing pat is not an option, so search every evasion.
+        if in_check and checks > 0:
+            moves = self.order_moves(position, check_evasions, ply=ply)
+            checks -= 1
+            # Evasions can repeat earlier positions.
+            self._hash_stack.append(position.key)
+            stand_pat = None
+            best_evaluation = float('-inf')
+            searching_evasions = True
         else:
-            min_eval = float('+inf')
-            for move in board.legal_moves:
-
-                # Make the move.
-                board.push(move)
-                # Evaluate the board.
-                evaluation = self.minimax(board, depth-1, alpha, beta, True)[1]
-                # Unmake the move.
-                board.pop()
-
-                # Update the best move.
-                if evaluation < min_eval:
-                    best_move = move
-                # Update the best evaluation.
-                min_eval = min(evaluation, min_eval)
-                # Update beta.
-                beta = min(beta, evaluation)
-
-                # Check for cut-offs.
-                if beta <= alpha:
-                    break
+            stand_pat = sign * self._evaluate(position) if static_evaluation is None else static_evaluation
+
+            # Stand pat.
+            if stand_pat >= beta:
+                return stand_pat
+            alpha = max(alpha, stand_pat)
+
+            moves = self.order_moves(position, position.generate_noisy_moves(), ply=ply)
+            best_evaluation = stand_pat
+            searching_evasions = False
+
+        for move in moves:
+
+            # Skip captures that cannot raise the evaluation to alpha.
+            if not searching_evasions and stand_pat + self._material_gain(position, move) + self.delta_margin <= alpha:
+                continue
+
+            position.push(move)
+            evaluation = -self._quiescence(position, -beta, -alpha, ply+1, checks)
+            position.pop()
+
+            best_evaluation = max(evaluation, best_evaluation)
+            alpha = max(alpha, evaluation)
+
+            if alpha >= beta:
+                break
+
+        if searching_evasions:
+            self._hash_stack.pop()
+
+        return best_evaluation
+
+    def _has_pieces(self, position):
+        """Checks whether the side to move has pieces other than pawns and its king."""
+        bitboards = position.bitboards
+        return bool(position.colours[position.turn] & ~bitboards[chess.PAWN] & ~bitboards[chess.KING])
+
+    def _board_of(self, position):
+        """Returns the chess.Board of a position reached from the root of the search.
 
-            return (best_move, min_eval)
+        The board is reused between calls, so it must not be changed or kept.
+        """
+
+        board = self._search_board
+        played = self._search_board_moves
+        moves = position.move_stack()
+
+        # Positions visited one after another share most of their moves, so only replay where they differ.
+        common = 0
+        limit = min(len(played), len(moves))
+        while common < limit and played[common] == moves[common]:
+            common += 1
+
+        for _ in range(len(played) - common):
+            board.pop()
+        for move in moves[common:]:
+            board.push(decode_move(move) or chess.Move.null())
+
+        self._search_board_moves = moves
+        return board
+
+    def _evaluate_children(self, position, moves):
+        """Returns the static evaluations of the positions after each move, from a single batch evaluation.
+
+        The evaluations are from the point of view of the side to move after the moves.
+        """
+
+        # Draws and mates below are found by the search itself, so the boards can leave out their move history.
+        board = self._board_of(position)
+        children = []
+        for move in moves:
+            board.push(decode_move(move))
+            children.append(board.copy(stack=False))
+            board.pop()
+
+        self.stats.leaf_evaluations += len(children)
+        sign = -1 if position.turn == chess.WHITE else 1
+        return {move: sign * evaluation for move, evaluation in zip(moves, self.calculate_batch_evaluation(children))}
+
+    def _evaluate(self, position):
+        """Returns the static evaluation of a position reached during the search."""
+
+        self.stats.leaf_evaluations += 1
+
+        if self.custom_evaluation:
+            return self.calculate_static_evaluation(self._board_of(position))
+
+        # Positions often recur during a search, for example in quiescence searches below sibling moves.
+        evaluation = self.evaluation_cache.probe(position.key)
+        if evaluation is None:
+            evaluation = self._evaluate_position(position)
+            self.evaluation_cache.store(position.key, evaluation)
+
+        if self.debug_evaluation:
+            board = self._board_of(position)
+            expected = evaluate_board(board)
+            if evaluation != expected:
+                raise AssertionError(f'incremental evaluation {evaluation} != {expected} after {board.move_stack} ({board.fen()})')
+
+        return evaluation
+
+    def _evaluate_position(self, position):
+        """Adds pawn structure, mobility and king safety to the running material and placement totals of a position."""
+
+        bitboards = position.bitboards
+        colours = position.colours
+
+        # Pawn structure only depends on the pawns, which rarely change, so it is cached separately.
+        pawn_scores = self.pawn_cache.probe(position.pawn_key)
+        if pawn_scores is None:
+            pawns = bitboards[chess.PAWN]
+            pawn_scores = evaluate_pawns(pawns & colours[chess.WHITE], pawns & colours[chess.BLACK])
+            self.pawn_cache.store(position.pawn_key, pawn_scores)
+
+        midgame, endgame = evaluate_activity(bitboards, colours, position.occupied)
+
+        return taper(
+            position.midgame + pawn_scores[0] + midgame,
+            position.endgame + pawn_scores[1] + endgame,
+            position.phase,
+        )
+
+    def _evaluate_terminal(self, position, evaluation):
+        """Returns the evaluation of a position where the game is over."""
+
+        # Custom evaluations are responsible for scoring terminal states themselves.
+        if self.custom_evaluation:
+            return self.calculate_static_evaluation(self._board_of(position))
+
+        return evaluation
+
+    def _mate_or_stalemate_evaluation(self, position):
+        """Returns the evaluation of a position with no legal moves."""
+        if not position.is_check():
+            return 0
+        return -MATE_EVALUATION if position.turn == chess.WHITE else +MATE_EVALUATION
+
+    def _bitbase_evaluation(self, position, result, ply):
+        """Converts a bitbase result for the side to move into an evaluation, preferring faster wins."""
+
+        outcome, plies = result
+        if outcome == DRAW:
+            return 0
+
+        evaluation = outcome * (BITBASE_EVALUATION - ply - plies)
+        return evaluation if position.turn == chess.WHITE else -evaluation
+
+    def _reset_hash_stack(self, board):
+        """Fills the hash stack with the game's positions since the last irreversible move."""
+
+        self._hash_stack.clear()
+        board = board.copy()
+
+        for _ in range(min(board.halfmove_clock, len(board.move_stack))):
+            board.pop()
+            self._hash_stack.append(chess.polyglot.zobrist_hash(board))
+
+        self._hash_stack.reverse()
+
+    def _is_draw(self, position, key):
+        """Checks for draws by insufficient material, the fifty-move rule or threefold repetition.
+
+        Gives the same answers as board.is_game_over(claim_draw=True) for positions
+        with legal moves, but avoids replaying the move stack at every node.
+        """
+
+        if position.is_insufficient_material():
+            return True
+
+        clock = position.halfmove_clock
+
+        # The fifty-move rule can be claimed from 99 half-moves on, if a move reaches 100.
+        if clock >= 99 and position.can_claim_fifty_moves():
+            return True
+
+        # Threefold repetition needs at least 8 reversible half-moves, or 7 if claimed upon the next move.
+        if clock < 7:
+            return False
+
+        # Only positions since the last irreversible move can repeat.
+        positions = self._hash_stack[-clock:]
+        positions.append(key)
+        if len(set(positions)) == len(positions):
+            return False
+
+        counts = Counter(positions)
+        if counts[key] >= 3:
+            return True
+
+        # A draw can also be claimed if a move would repeat a position for the third time.
+        repeated = {position_key for position_key, count in counts.items() if count >= 2}
+        for move in position.legal_moves():
+            position.push(move)
+            repeats = position.key in repeated
+            position.pop()
+            if repeats:
+                return True
+
+        return False
+
+    def _material_gain(self, position, move):
+        """Returns the material a capture or promotion wins, ignoring recaptures."""
+
+        if position.is_en_passant(move):
+            gain = PIECE_VALUES[chess.PAWN]
+        else:
+            victim = position.squares[(move >> 6) & 0x3f] & 7
+            gain = PIECE_VALUES[victim] if victim else 0
+
+        promotion = move >> 12
+        if promotion:
+            gain += PIECE_VALUES[promotion] - PIECE_VALUES[chess.PAWN]
+
+        return gain
+
+    def _store(self, key, depth, evaluation, alpha, beta, best_move):
+        """Stores a search result in the transposition table, given the window it was searched with."""
+
+        if evaluation <= alpha:
+            bound = UPPER_BOUND
+        elif evaluation >= beta:
+            bound = LOWER_BOUND
+        else:
+            bound = EXACT
+
+        self.transposition_table.store(key, depth, evaluation, bound, best_move)
+
+    def calculate_batch_evaluation(self, boards):
+        """Returns static evaluations of many board states at once.
+
+        The built-in version gives the same scores as evaluate_board, summing material
+        and piece placement with NumPy, and does not check whether the games are over. Boards passed in by the search
+        have no move history, as it finds draws and mates itself.
+        """
+
+        if self.custom_evaluation:
+            return [self.calculate_static_evaluation(board) for board in boards]
+
+        return evaluate_batch(boards)
+
+    def _evaluate_single_board(self, board):
+        """Scores one board with the batch evaluation."""
+        return self.calculate_batch_evaluation([board])[0]
 
     def calculate_static_evaluation(self, board):
         """Returns a static evaluation of a board state."""
@@ -80,28 +1125,42 @@ class Agent:
             else:
                 return 0
 
-        centipawn_evaluation = 0
+        # Evaluate material, piece placement, pawn structure, mobility and king safety,
+        # tapered between the midgame and endgame.
+        centipawn_evaluation = evaluate_board(board)
+
+        return centipawn_evaluation
 
-        # Evaluate material.
-        material_balance = 0
-        material_balance += len(board.pieces(chess.PAWN, chess.WHITE)) * +100
-        material_balance += len(board.pieces(chess.PAWN, chess.BLACK)) * -100
-        material_balance += len(board.pieces(chess.ROOK, chess.WHITE)) * +500
-        material_balance += len(board.pieces(chess.ROOK, chess.BLACK)) * -500
-        material_balance += len(board.pieces(chess.KNIGHT, chess.WHITE)) * +300
-        material_balance += len(board.pieces(chess.KNIGHT, chess.BLACK)) * -300
-        material_balance += len(board.pieces(chess.BISHOP, chess.WHITE)) * +300
-        material_balance += len(board.pieces(chess.BISHOP, chess.BLACK)) * -300
-        material_balance += len(board.pieces(chess.QUEEN, chess.WHITE)) * +900
-        material_balance += len(board.pieces(chess.QUEEN, chess.BLACK)) * -900
+# The agent of a helper process, and the event that stops its searches.
+_helper_agent = None
+_helper_stop_event = None
 
-        # TODO: Evaluate mobility.
-        mobility = 0
 
-        # Aggregate values.
-        centipawn_evaluation = material_balance + mobility
+def _initialize_helper(table_name, table_path, options, stop_event):
+    """Sets up a helper process with an agent attached to the shared transposition table."""
+
+    global _helper_agent, _helper_stop_event
+
+    _helper_agent = Agent(hash_size_mb=0, **options)
+    _helper_agent.transposition_table.close()
+    if table_path is not None:
+        _helper_agent.transposition_table = TranspositionTable.attach_file(table_path)
+    else:
+        _helper_agent.transposition_table = TranspositionTable.attach(table_name)
+    _helper_stop_event = stop_event
+
+
+def _helper_search(board, max_depth, first_depth, generation):
+    """Searches a position in a helper process until the main search stops it."""
+
+    agent = _helper_agent
+    agent._start_search(stop_event=_helper_stop_event)
+    agent.transposition_table.new_search(generation)
+
+    move, evaluation = agent._iterative_deepening(board, max_depth, first_depth)
+
+    return move, evaluation, agent.depth, agent.nodes
 
-        return centipawn_evaluation
 
 def main():
     
@@ -109,11 +1168,14 @@ def main():
     m2 = chess.Board('8/6k1/8/8/8/8/1K2R3/5R2 w - - 0 1') # e2g2
     m3 = chess.Board('8/8/5k2/8/8/8/3R4/4R3 w - - 0 1') # d2f2
 
-    agent = Agent()
-
-    # print(agent.minimax(m1, 2, float('-inf'), float('+inf'), True)[0])
-    # print(agent.minimax(m2, 4, float('-inf'), float('+inf'), True)[0])
-    # print(agent.minimax(m3, 6, float('-inf'), float('+inf'), True)[0])
+    # Compare the nodes searched to find each mate, with and without move ordering.
+    for name, board, depth in (('m1', m1, 2), ('m2', m2, 4), ('m3', m3, 6)):
+        for move_ordering in (False, True):
+            agent = Agent(move_ordering=move_ordering)
+            start = time.monotonic()
+            move, evaluation = agent.search(board, max_depth=depth)
+            elapsed = time.monotonic() - start
+            print(f'{name} ordering={move_ordering!s:5} move={move} eval={evaluation} nodes={agent.nodes} time={elapsed:.2f}s')
 
 
 if __name__ == '__main__':
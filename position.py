@@ -0,0 +1,798 @@
+import sys
+import time
+
+import chess
+import chess.polyglot
+
+from evaluation import ENDGAME_VALUES, MIDGAME_VALUES, PHASE_WEIGHTS
+from transposition import decode_move
+
+# The most moves that can be made from the root position before they are unmade.
+MAX_MOVES = 1024
+
+# Zobrist keys, laid out as in Polyglot so that keys match chess.polyglot.zobrist_hash.
+PIECE_KEYS = [
+    [
+        [0] * 64 if piece_type == 0 else [
+            chess.polyglot.POLYGLOT_RANDOM_ARRAY[64 * (2 * (piece_type - 1) + colour) + square]
+            for square in chess.SQUARES
+        ]
+        for piece_type in range(7)
+    ]
+    for colour in (chess.BLACK, chess.WHITE)
+]
+CASTLING_KEYS = {
+    chess.H1: chess.polyglot.POLYGLOT_RANDOM_ARRAY[768],
+    chess.A1: chess.polyglot.POLYGLOT_RANDOM_ARRAY[769],
+    chess.H8: chess.polyglot.POLYGLOT_RANDOM_ARRAY[770],
+    chess.A8: chess.polyglot.POLYGLOT_RANDOM_ARRAY[771],
+}
+EN_PASSANT_KEYS = chess.polyglot.POLYGLOT_RANDOM_ARRAY[772:780]
+TURN_KEY = chess.polyglot.POLYGLOT_RANDOM_ARRAY[780]
+
+CASTLING_SQUARES = chess.BB_A1 | chess.BB_H1 | chess.BB_A8 | chess.BB_H8
+
+PROMOTIONS = (chess.QUEEN, chess.ROOK, chess.BISHOP, chess.KNIGHT)
+
+# Attack tables, bound to module globals for the move generator.
+BB_KNIGHT_ATTACKS = chess.BB_KNIGHT_ATTACKS
+BB_KING_ATTACKS = chess.BB_KING_ATTACKS
+BB_DIAG_ATTACKS = chess.BB_DIAG_ATTACKS
+BB_DIAG_MASKS = chess.BB_DIAG_MASKS
+BB_RANK_ATTACKS = chess.BB_RANK_ATTACKS
+BB_RANK_MASKS = chess.BB_RANK_MASKS
+BB_FILE_ATTACKS = chess.BB_FILE_ATTACKS
+BB_FILE_MASKS = chess.BB_FILE_MASKS
+
+
+def _castling_key(castling):
+    """Returns the Zobrist key of a set of castling rights."""
+    key = 0
+    for square, square_key in CASTLING_KEYS.items():
+        if castling & chess.BB_SQUARES[square]:
+            key ^= square_key
+    return key
+
+
+CASTLING_RIGHTS_KEYS = {}
+for _rights in range(16):
+    _castling = 0
+    for _bit, _square in enumerate((chess.A1, chess.H1, chess.A8, chess.H8)):
+        if _rights >> _bit & 1:
+            _castling |= chess.BB_SQUARES[_square]
+    CASTLING_RIGHTS_KEYS[_castling] = _castling_key(_castling)
+
+
+class Position:
+    """A chess position for the search, kept as integer bitboards and a mailbox.
+
+    Moves are integers packed as by transposition.encode_move. Moves are made
+    with push and unmade with pop, which restores the position from a
+    preallocated undo stack instead of copying it. The Polyglot Zobrist key, a
+    key of the pawns alone, and the material and piece-square totals of
+    evaluation.evaluate_pieces are kept up to date as moves are made.
+    """
+
+    __slots__ = (
+        'bitboards', 'colours', 'occupied', 'squares', 'turn', 'castling', 'ep_square',
+        'halfmove_clock', 'fullmove_number', 'key', 'pawn_key', 'midgame', 'endgame', 'phase', 'ply',
+        '_moves', '_captured', '_castling', '_ep_square', '_halfmove_clock', '_key', '_pawn_key',
+        '_midgame', '_endgame', '_phase',
+    )
+
+    def __init__(self, board=None):
+
+        # Bitboards by piece type (index 0 is unused) and by colour.
+        self.bitboards = [0] * 7
+        self.colours = [0, 0]
+        self.occupied = 0
+
+        # The mailbox holds piece_type | colour << 3 for each square, or 0 if it is empty.
+        self.squares = [0] * 64
+
+        self.turn = chess.WHITE
+        self.castling = 0
+        self.ep_square = None
+        self.halfmove_clock = 0
+        self.fullmove_number = 1
+        self.key = 0
+        self.pawn_key = 0
+
+        self.midgame = 0
+        self.endgame = 0
+        self.phase = 0
+
+        # The undo stack.
+        self.ply = 0
+        self._moves = [0] * MAX_MOVES
+        self._captured = [0] * MAX_MOVES
+        self._castling = [0] * MAX_MOVES
+        self._ep_square = [None] * MAX_MOVES
+        self._halfmove_clock = [0] * MAX_MOVES
+        self._key = [0] * MAX_MOVES
+        self._pawn_key = [0] * MAX_MOVES
+        self._midgame = [0] * MAX_MOVES
+        self._endgame = [0] * MAX_MOVES
+        self._phase = [0] * MAX_MOVES
+
+        if board is not None:
+            self.set_board(board)
+
+    def set_board(self, board):
+        """Sets up the position of a chess.Board. Its move stack is not copied."""
+
+        self.bitboards = [0] * 7
+        self.colours = [0, 0]
+        self.occupied = 0
+        self.squares = [0] * 64
+        self.midgame = self.endgame = self.phase = 0
+        self.key = 0
+        self.pawn_key = 0
+        self.ply = 0
+
+        for square, piece in board.piece_map().items():
+            self._add_piece(square, piece.piece_type, piece.color)
+
+        self.turn = board.turn
+        self.castling = board.clean_castling_rights() & CASTLING_SQUARES
+        self.ep_square = board.ep_square
+        self.halfmove_clock = board.halfmove_clock
+        self.fullmove_number = board.fullmove_number
+
+        self.key ^= CASTLING_RIGHTS_KEYS[self.castling] ^ self._en_passant_key()
+        if self.turn == chess.WHITE:
+            self.key ^= TURN_KEY
+
+    def to_board(self):
+        """Returns the position as a chess.Board, without a move stack."""
+
+        board = chess.Board(None)
+        for square in chess.SQUARES:
+            piece = self.squares[square]
+            if piece:
+                board.set_piece_at(square, chess.Piece(piece & 7, bool(piece >> 3)))
+
+        board.turn = self.turn
+        board.castling_rights = self.castling
+        board.ep_square = self.ep_square
+        board.halfmove_clock = self.halfmove_clock
+        board.fullmove_number = self.fullmove_number
+        return board
+
+    def move_stack(self):
+        """Returns the moves made since the position was set up."""
+        return self._moves[:self.ply]
+
+    def _add_piece(self, square, piece_type, colour):
+        mask = chess.BB_SQUARES[square]
+        self.bitboards[piece_type] |= mask
+        self.colours[colour] |= mask
+        self.occupied |= mask
+        self.squares[square] = piece_type | colour << 3
+        self.key ^= PIECE_KEYS[colour][piece_type][square]
+        if piece_type == chess.PAWN:
+            self.pawn_key ^= PIECE_KEYS[colour][chess.PAWN][square]
+        self.midgame += MIDGAME_VALUES[colour][piece_type][square]
+        self.endgame += ENDGAME_VALUES[colour][piece_type][square]
+        self.phase += PHASE_WEIGHTS[piece_type]
+
+    def _remove_piece(self, square, piece_type, colour):
+        mask = chess.BB_SQUARES[square]
+        self.bitboards[piece_type] ^= mask
+        self.colours[colour] ^= mask
+        self.occupied ^= mask
+        self.squares[square] = 0
+        self.key ^= PIECE_KEYS[colour][piece_type][square]
+        if piece_type == chess.PAWN:
+            self.pawn_key ^= PIECE_KEYS[colour][chess.PAWN][square]
+        self.midgame -= MIDGAME_VALUES[colour][piece_type][square]
+        self.endgame -= ENDGAME_VALUES[colour][piece_type][square]
+        self.phase -= PHASE_WEIGHTS[piece_type]
+
+    def _en_passant_key(self):
+        """Returns the key of the en passant square, which Polyglot only counts if a pawn could capture."""
+
+        ep_square = self.ep_square
+        if ep_square is None:
+            return 0
+
+        pawns = self.bitboards[chess.PAWN] & self.colours[self.turn]
+        if chess.BB_PAWN_ATTACKS[not self.turn][ep_square] & pawns:
+            return EN_PASSANT_KEYS[ep_square & 7]
+        return 0
+
+    def push(self, move):
+        """Makes a legal move."""
+
+        ply = self.ply
+        self._moves[ply] = move
+        self._castling[ply] = self.castling
+        self._ep_square[ply] = self.ep_square
+        self._halfmove_clock[ply] = self.halfmove_clock
+        self._key[ply] = self.key
+        self._pawn_key[ply] = self.pawn_key
+        self._midgame[ply] = self.midgame
+        self._endgame[ply] = self.endgame
+        self._phase[ply] = self.phase
+        self.ply = ply + 1
+
+        turn = self.turn
+        from_square = move & 0x3f
+        to_square = (move >> 6) & 0x3f
+        promotion = move >> 12
+        piece_type = self.squares[from_square] & 7
+
+        self.key ^= CASTLING_RIGHTS_KEYS[self.castling] ^ self._en_passant_key()
+
+        # Remove any captured piece.
+        captured = self.squares[to_square]
+        if captured:
+            self._remove_piece(to_square, captured & 7, not turn)
+        elif piece_type == chess.PAWN and to_square == self.ep_square:
+            captured = chess.PAWN | (not turn) << 3
+            self._remove_piece(to_square - 8 if turn == chess.WHITE else to_square + 8, chess.PAWN, not turn)
+        self._captured[ply] = captured
+
+        # Move the piece, promoting it if necessary.
+        self._remove_piece(from_square, piece_type, turn)
+        self._add_piece(to_square, promotion or piece_type, turn)
+
+        # Move the rook when castling.
+        if piece_type == chess.KING and (to_square - from_square == 2 or from_square - to_square == 2):
+            if to_square > from_square:
+                self._remove_piece(to_square + 1, chess.ROOK, turn)
+                self._add_piece(to_square - 1, chess.ROOK, turn)
+            else:
+                self._remove_piece(to_square - 2, chess.ROOK, turn)
+                self._add_piece(to_square + 1, chess.ROOK, turn)
+
+        # Moving the king or a rook, or capturing a rook, loses castling rights.
+        if self.castling:
+            self.castling &= ~(chess.BB_SQUARES[from_square] | chess.BB_SQUARES[to_square])
+            if piece_type == chess.KING:
+                self.castling &= ~(chess.BB_RANK_1 if turn == chess.WHITE else chess.BB_RANK_8)
+
+        if piece_type == chess.PAWN and (to_square - from_square == 16 or from_square - to_square == 16):
+            self.ep_square = (from_square + to_square) >> 1
+        else:
+            self.ep_square = None
+
+        if piece_type == chess.PAWN or captured:
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+
+        if turn == chess.BLACK:
+            self.fullmove_number += 1
+
+        self.turn = not turn
+        self.key ^= TURN_KEY ^ CASTLING_RIGHTS_KEYS[self.castling] ^ self._en_passant_key()
+
+    def push_null(self):
+        """Passes the turn without moving, for null move pruning. Unmade with pop."""
+
+        ply = self.ply
+        self._moves[ply] = 0
+        self._captured[ply] = 0
+        self._castling[ply] = self.castling
+        self._ep_square[ply] = self.ep_square
+        self._halfmove_clock[ply] = self.halfmove_clock
+        self._key[ply] = self.key
+        self._pawn_key[ply] = self.pawn_key
+        self._midgame[ply] = self.midgame
+        self._endgame[ply] = self.endgame
+        self._phase[ply] = self.phase
+        self.ply = ply + 1
+
+        self.key ^= self._en_passant_key() ^ TURN_KEY
+        self.ep_square = None
+
+        # Positions on either side of a null move must not count as repetitions.
+        self.halfmove_clock = 0
+
+        if self.turn == chess.BLACK:
+            self.fullmove_number += 1
+        self.turn = not self.turn
+
+    def last_move(self):
+        """Returns the last move made, 0 for a null move, or None if no move has been made."""
+        return self._moves[self.ply - 1] if self.ply else None
+
+    def pop(self):
+        """Unmakes the last move made with push or push_null."""
+
+        ply = self.ply - 1
+        self.ply = ply
+        move = self._moves[ply]
+
+        turn = not self.turn
+
+        # Null moves only changed what is restored from the stack below.
+        if move:
+            from_square = move & 0x3f
+            to_square = (move >> 6) & 0x3f
+            promotion = move >> 12
+            piece = self.squares[to_square]
+            piece_type = chess.PAWN if promotion else piece & 7
+
+            # Take back the rook when castling.
+            if piece_type == chess.KING and (to_square - from_square == 2 or from_square - to_square == 2):
+                if to_square > from_square:
+                    rook_from, rook_to = to_square + 1, to_square - 1
+                else:
+                    rook_from, rook_to = to_square - 2, to_square + 1
+                self._move_piece_back(rook_to, rook_from, chess.ROOK, chess.ROOK | turn << 3, turn)
+
+            self._move_piece_back(to_square, from_square, piece & 7, piece_type | turn << 3, turn)
+            if promotion:
+                self.bitboards[promotion] ^= chess.BB_SQUARES[from_square]
+                self.bitboards[chess.PAWN] ^= chess.BB_SQUARES[from_square]
+
+            # Put back any captured piece.
+            captured = self._captured[ply]
+            if captured:
+                if piece_type == chess.PAWN and to_square == self._ep_square[ply]:
+                    capture_square = to_square - 8 if turn == chess.WHITE else to_square + 8
+                else:
+                    capture_square = to_square
+                mask = chess.BB_SQUARES[capture_square]
+                self.bitboards[captured & 7] |= mask
+                self.colours[not turn] |= mask
+                self.occupied |= mask
+                self.squares[capture_square] = captured
+
+        if turn == chess.BLACK:
+            self.fullmove_number -= 1
+
+        self.turn = turn
+        self.castling = self._castling[ply]
+        self.ep_square = self._ep_square[ply]
+        self.halfmove_clock = self._halfmove_clock[ply]
+        self.key = self._key[ply]
+        self.pawn_key = self._pawn_key[ply]
+        self.midgame = self._midgame[ply]
+        self.endgame = self._endgame[ply]
+        self.phase = self._phase[ply]
+
+    def _move_piece_back(self, from_square, to_square, piece_type, piece, colour):
+        """Moves a piece without updating the key or scores, which pop restores from the stack."""
+        masks = chess.BB_SQUARES[from_square] | chess.BB_SQUARES[to_square]
+        self.bitboards[piece_type] ^= masks
+        self.colours[colour] ^= masks
+        self.occupied ^= masks
+        self.squares[from_square] = 0
+        self.squares[to_square] = piece
+
+    def attackers(self, colour, square, occupied=None):
+        """Returns the pieces of a colour that attack a square."""
+
+        if occupied is None:
+            occupied = self.occupied
+
+        bitboards = self.bitboards
+        queens = bitboards[chess.QUEEN]
+
+        attackers = (
+            chess.BB_KNIGHT_ATTACKS[square] & bitboards[chess.KNIGHT]
+            | chess.BB_KING_ATTACKS[square] & bitboards[chess.KING]
+            | chess.BB_PAWN_ATTACKS[not colour][square] & bitboards[chess.PAWN]
+            | chess.BB_RANK_ATTACKS[square][chess.BB_RANK_MASKS[square] & occupied] & (bitboards[chess.ROOK] | queens)
+            | chess.BB_FILE_ATTACKS[square][chess.BB_FILE_MASKS[square] & occupied] & (bitboards[chess.ROOK] | queens)
+            | chess.BB_DIAG_ATTACKS[square][chess.BB_DIAG_MASKS[square] & occupied] & (bitboards[chess.BISHOP] | queens)
+        )
+
+        return attackers & self.colours[colour]
+
+    def is_check(self):
+        """Checks whether the side to move is in check."""
+        king = self.bitboards[chess.KING] & self.colours[self.turn]
+        return bool(king and self.attackers(not self.turn, king.bit_length() - 1))
+
+    def is_capture(self, move):
+        """Checks whether a move captures a piece, including en passant."""
+        to_square = (move >> 6) & 0x3f
+        if self.squares[to_square]:
+            return True
+        return to_square == self.ep_square and self.squares[move & 0x3f] & 7 == chess.PAWN
+
+    def is_en_passant(self, move):
+        """Checks whether a move is an en passant capture."""
+        to_square = (move >> 6) & 0x3f
+        return to_square == self.ep_square and self.squares[move & 0x3f] & 7 == chess.PAWN and not self.squares[to_square]
+
+    def is_zeroing(self, move):
+        """Checks whether a move resets the fifty-move counter."""
+        return self.squares[move & 0x3f] & 7 == chess.PAWN or self.is_capture(move)
+
+    def _piece_attacks(self, piece_type, square, occupied):
+        """Returns the squares a non-pawn piece attacks."""
+
+        if piece_type == chess.KNIGHT:
+            return chess.BB_KNIGHT_ATTACKS[square]
+        if piece_type == chess.KING:
+            return chess.BB_KING_ATTACKS[square]
+
+        attacks = 0
+        if piece_type != chess.ROOK:
+            attacks = chess.BB_DIAG_ATTACKS[square][chess.BB_DIAG_MASKS[square] & occupied]
+        if piece_type != chess.BISHOP:
+            attacks |= (
+                chess.BB_RANK_ATTACKS[square][chess.BB_RANK_MASKS[square] & occupied]
+                | chess.BB_FILE_ATTACKS[square][chess.BB_FILE_MASKS[square] & occupied]
+            )
+        return attacks
+
+    def generate_pseudo_legal_moves(self, to_mask=chess.BB_ALL):
+        """Returns the pseudo-legal moves to squares in to_mask, in the order python-chess generates them."""
+
+        moves = []
+        append = moves.append
+
+        turn = self.turn
+        ours = self.colours[turn]
+        theirs = self.colours[not turn]
+        occupied = self.occupied
+        squares = self.squares
+        pawns = self.bitboards[chess.PAWN] & ours
+
+        # Piece moves. Attacks are looked up inline, as this is the hottest loop of the search.
+        pieces = ours & ~pawns
+        targets = ~ours & to_mask
+        while pieces:
+            from_square = pieces.bit_length() - 1
+            pieces ^= 1 << from_square
+
+            piece_type = squares[from_square] & 7
+            if piece_type == chess.KNIGHT:
+                attacks = BB_KNIGHT_ATTACKS[from_square]
+            elif piece_type == chess.KING:
+                attacks = BB_KING_ATTACKS[from_square]
+            else:
+                attacks = 0
+                if piece_type != chess.ROOK:
+                    attacks = BB_DIAG_ATTACKS[from_square][BB_DIAG_MASKS[from_square] & occupied]
+                if piece_type != chess.BISHOP:
+                    attacks |= (
+                        BB_RANK_ATTACKS[from_square][BB_RANK_MASKS[from_square] & occupied]
+                        | BB_FILE_ATTACKS[from_square][BB_FILE_MASKS[from_square] & occupied]
+                    )
+
+            attacks &= targets
+            while attacks:
+                to_square = attacks.bit_length() - 1
+                attacks ^= 1 << to_square
+                append(from_square | to_square << 6)
+
+        # Castling moves.
+        backrank = chess.BB_RANK_1 if turn == chess.WHITE else chess.BB_RANK_8
+        if self.castling & backrank:
+            self._generate_castling_moves(moves, backrank, to_mask)
+
+        if not pawns:
+            return moves
+
+        # Pawn captures.
+        capturers = pawns
+        while capturers:
+            from_square = capturers.bit_length() - 1
+            capturers ^= 1 << from_square
+
+            attacks = chess.BB_PAWN_ATTACKS[turn][from_square] & theirs & to_mask
+            while attacks:
+                to_square = attacks.bit_length() - 1
+                attacks ^= 1 << to_square
+                if to_square < 8 or to_square >= 56:
+                    for promotion in PROMOTIONS:
+                        append(from_square | to_square << 6 | promotion << 12)
+                else:
+                    append(from_square | to_square << 6)
+
+        # Pawn advances.
+        if turn == chess.WHITE:
+            single_moves = pawns << 8 & ~occupied
+            double_moves = single_moves << 8 & ~occupied & chess.BB_RANK_4
+            step = -8
+        else:
+            single_moves = pawns >> 8 & ~occupied
+            double_moves = single_moves >> 8 & ~occupied & chess.BB_RANK_5
+            step = 8
+
+        single_moves &= to_mask
+        double_moves &= to_mask
+
+        while single_moves:
+            to_square = single_moves.bit_length() - 1
+            single_moves ^= 1 << to_square
+            from_square = to_square + step
+            if to_square < 8 or to_square >= 56:
+                for promotion in PROMOTIONS:
+                    append(from_square | to_square << 6 | promotion << 12)
+            else:
+                append(from_square | to_square << 6)
+
+        while double_moves:
+            to_square = double_moves.bit_length() - 1
+            double_moves ^= 1 << to_square
+            append(to_square + 2 * step | to_square << 6)
+
+        # En passant captures.
+        ep_square = self.ep_square
+        if ep_square is not None and chess.BB_SQUARES[ep_square] & to_mask and not chess.BB_SQUARES[ep_square] & occupied:
+            capturers = pawns & chess.BB_PAWN_ATTACKS[not turn][ep_square] & (chess.BB_RANK_5 if turn == chess.WHITE else chess.BB_RANK_4)
+            while capturers:
+                from_square = capturers.bit_length() - 1
+                capturers ^= 1 << from_square
+                append(from_square | ep_square << 6)
+
+        return moves
+
+    def _generate_castling_moves(self, moves, backrank, to_mask):
+        """Adds the castling moves of the side to move, kingside first."""
+
+        turn = self.turn
+        king = self.bitboards[chess.KING] & self.colours[turn] & backrank & chess.BB_FILE_E
+        if not king:
+            return
+
+        king_square = king.bit_length() - 1
+        occupied = self.occupied
+        them = not turn
+
+        # The king may not castle out of, through or into check.
+        if self.castling & backrank & chess.BB_FILE_H and to_mask & chess.BB_SQUARES[king_square + 2]:
+            if not occupied & (chess.BB_SQUARES[king_square + 1] | chess.BB_SQUARES[king_square + 2]):
+                if not any(self.attackers(them, square) for square in (king_square, king_square + 1, king_square + 2)):
+                    moves.append(king_square | (king_square + 2) << 6)
+
+        if self.castling & backrank & chess.BB_FILE_A and to_mask & chess.BB_SQUARES[king_square - 2]:
+            path = chess.BB_SQUARES[king_square - 1] | chess.BB_SQUARES[king_square - 2] | chess.BB_SQUARES[king_square - 3]
+            if not occupied & path:
+                if not any(self.attackers(them, square) for square in (king_square, king_square - 1, king_square - 2)):
+                    moves.append(king_square | (king_square - 2) << 6)
+
+    def _slider_blockers(self, king):
+        """Returns our pieces that are the only piece between our king and an enemy slider."""
+
+        bitboards = self.bitboards
+        rooks_and_queens = bitboards[chess.ROOK] | bitboards[chess.QUEEN]
+        bishops_and_queens = bitboards[chess.BISHOP] | bitboards[chess.QUEEN]
+
+        snipers = (
+            (chess.BB_RANK_ATTACKS[king][0] | chess.BB_FILE_ATTACKS[king][0]) & rooks_and_queens
+            | chess.BB_DIAG_ATTACKS[king][0] & bishops_and_queens
+        ) & self.colours[not self.turn]
+
+        blockers = 0
+        while snipers:
+            sniper = snipers.bit_length() - 1
+            snipers ^= 1 << sniper
+
+            between = chess.between(king, sniper) & self.occupied
+            if between and not between & (between - 1):
+                blockers |= between
+
+        return blockers & self.colours[self.turn]
+
+    def _filter_legal(self, moves, first_only=False):
+        """Returns the pseudo-legal moves that do not leave the king in check."""
+
+        king_mask = self.bitboards[chess.KING] & self.colours[self.turn]
+        if not king_mask:
+            return moves
+
+        king = king_mask.bit_length() - 1
+        them = not self.turn
+        blockers = self._slider_blockers(king)
+        checkers = self.attackers(them, king)
+        if checkers:
+            # Pieces other than the king can only capture or block a single checker.
+            if checkers & (checkers - 1):
+                evasion_targets = 0
+            else:
+                evasion_targets = chess.between(king, checkers.bit_length() - 1) | checkers
+            without_king = self.occupied ^ king_mask
+
+        legal = []
+        for move in moves:
+            from_square = move & 0x3f
+            to_square = (move >> 6) & 0x3f
+
+            if from_square == king:
+                if to_square - from_square == 2 or from_square - to_square == 2:
+                    is_legal = True
+                elif checkers:
+                    # Sliders attack through the square the king is leaving.
+                    is_legal = not self.attackers(them, to_square, without_king)
+                else:
+                    is_legal = not self.attackers(them, to_square)
+            elif self.is_en_passant(move):
+                self.push(move)
+                is_legal = not self.attackers(them, king)
+                self.pop()
+            elif checkers and not evasion_targets & chess.BB_SQUARES[to_square]:
+                is_legal = False
+            else:
+                is_legal = not blockers & chess.BB_SQUARES[from_square] or bool(chess.BB_RAYS[from_square][to_square] & king_mask)
+
+            if is_legal:
+                legal.append(move)
+                if first_only:
+                    break
+
+        return legal
+
+    def legal_moves(self):
+        """Returns the legal moves."""
+        return self._filter_legal(self.generate_pseudo_legal_moves())
+
+    def has_legal_moves(self):
+        """Checks whether the side to move has any legal move."""
+
+        turn = self.turn
+        ours = self.colours[turn]
+        king_mask = self.bitboards[chess.KING] & ours
+
+        # Out of check, any move of a piece that is not pinned is legal, which settles most positions quickly.
+        if king_mask and not self.attackers(not turn, king_mask.bit_length() - 1):
+            occupied = self.occupied
+            unpinned = ours & ~king_mask & ~self._slider_blockers(king_mask.bit_length() - 1)
+            pawns = unpinned & self.bitboards[chess.PAWN]
+
+            if (pawns << 8 if turn == chess.WHITE else pawns >> 8) & ~occupied:
+                return True
+
+            pieces = unpinned & ~pawns
+            while pieces:
+                square = pieces.bit_length() - 1
+                pieces ^= 1 << square
+                if self._piece_attacks(self.squares[square] & 7, square, occupied) & ~ours:
+                    return True
+
+        return bool(self._filter_legal(self.generate_pseudo_legal_moves(), first_only=True))
+
+    def is_legal(self, move):
+        """Checks whether a move is legal."""
+        return move in self.legal_moves()
+
+    def is_checkmate(self):
+        """Checks whether the side to move is checkmated."""
+        return self.is_check() and not self.has_legal_moves()
+
+    def generate_noisy_moves(self):
+        """Returns the legal captures, then quiet queen promotions, in the order python-chess generates them."""
+
+        theirs = self.colours[not self.turn]
+        promotion_rank = chess.BB_RANK_8 if self.turn == chess.WHITE else chess.BB_RANK_1
+        to_mask = theirs | promotion_rank & ~self.occupied
+        if self.ep_square is not None:
+            to_mask |= chess.BB_SQUARES[self.ep_square]
+
+        captures = []
+        en_passant = []
+        promotions = []
+
+        for move in self._filter_legal(self.generate_pseudo_legal_moves(to_mask)):
+            if self.squares[(move >> 6) & 0x3f]:
+                captures.append(move)
+            elif self.is_en_passant(move):
+                en_passant.append(move)
+            # Under-promotions without a capture are rarely worth resolving.
+            elif move >> 12 == chess.QUEEN:
+                promotions.append(move)
+
+        return captures + en_passant + promotions
+
+    def is_insufficient_material(self):
+        """Checks whether neither side can possibly win, as chess.Board.is_insufficient_material does."""
+        return all(self._has_insufficient_material(colour) for colour in chess.COLORS)
+
+    def _has_insufficient_material(self, colour):
+        bitboards = self.bitboards
+        ours = self.colours[colour]
+
+        if ours & (bitboards[chess.PAWN] | bitboards[chess.ROOK] | bitboards[chess.QUEEN]):
+            return False
+
+        if ours & bitboards[chess.KNIGHT]:
+            return (chess.popcount(ours) <= 2 and
+                    not (self.colours[not colour] & ~bitboards[chess.KING] & ~bitboards[chess.QUEEN]))
+
+        if ours & bitboards[chess.BISHOP]:
+            bishops = bitboards[chess.BISHOP]
+            same_colour = not bishops & chess.BB_DARK_SQUARES or not bishops & chess.BB_LIGHT_SQUARES
+            return same_colour and not bitboards[chess.PAWN] and not bitboards[chess.KNIGHT]
+
+        return True
+
+    def can_claim_fifty_moves(self):
+        """Checks whether a draw can be claimed by the fifty-move rule, as chess.Board.can_claim_fifty_moves does."""
+
+        if self.halfmove_clock >= 100 and self.has_legal_moves():
+            return True
+
+        if self.halfmove_clock >= 99:
+            for move in self.legal_moves():
+                if not self.is_zeroing(move):
+                    self.push(move)
+                    claimable = self.has_legal_moves()
+                    self.pop()
+                    if claimable:
+                        return True
+
+        return False
+
+
+def perft(position, depth):
+    """Counts the leaf nodes of the legal move tree to a depth."""
+
+    moves = position.legal_moves()
+    if depth == 1:
+        return len(moves)
+
+    nodes = 0
+    for move in moves:
+        position.push(move)
+        nodes += perft(position, depth - 1)
+        position.pop()
+
+    return nodes
+
+
+def _python_chess_divide(board, depth):
+    """Returns the perft count after each legal move, using python-chess."""
+
+    counts = {}
+    for move in board.legal_moves:
+        board.push(move)
+        counts[move] = 1 if depth == 1 else _python_chess_perft(board, depth - 1)
+        board.pop()
+    return counts
+
+
+def _python_chess_perft(board, depth):
+    if depth == 1:
+        return board.legal_moves.count()
+    nodes = 0
+    for move in board.legal_moves:
+        board.push(move)
+        nodes += _python_chess_perft(board, depth - 1)
+        board.pop()
+    return nodes
+
+
+def main():
+
+    from bench import PERFT_POSITIONS
+
+    depth = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    failures = 0
+
+    # Compare the count after each root move, so a mismatch points at the move that goes wrong.
+    for name, (fen, _) in PERFT_POSITIONS.items():
+        board = chess.Board(fen)
+        position = Position(board)
+
+        start = time.perf_counter()
+        expected = _python_chess_divide(board, depth)
+        reference_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        counts = {}
+        for move in position.legal_moves():
+            position.push(move)
+            counts[decode_move(move)] = 1 if depth == 1 else perft(position, depth - 1)
+            position.pop()
+        elapsed = time.perf_counter() - start
+
+        mismatches = {move.uci(): (counts.get(move), expected.get(move)) for move in expected.keys() | counts.keys()
+                      if counts.get(move) != expected.get(move)}
+        failures += bool(mismatches)
+
+        print(f'{name}: {sum(counts.values())} nodes in {elapsed:.2f}s (python-chess {reference_time:.2f}s)'
+              f'{" MISMATCH " + str(mismatches) if mismatches else ""}')
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
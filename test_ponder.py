@@ -0,0 +1,63 @@
+import io
+import threading
+import time
+import unittest
+
+import chess
+
+from minimax import Agent
+from uci import UCIEngine
+
+# A pondering search must finish within its movetime after ponderhit, give or take this many seconds.
+TOLERANCE = 1.0
+
+
+class PonderhitTest(unittest.TestCase):
+    """Checks that a ponderhit is never lost, however soon it follows the start of a pondering search."""
+
+    def setUp(self):
+        self.agent = Agent()
+        self.board = chess.Board()
+        self.board.push_uci('e2e4')
+
+    def tearDown(self):
+        self.agent.close()
+
+    def _ponder(self, movetime):
+        """Starts a pondering search on a worker thread, as the GUI does."""
+        self.agent.begin_ponder()
+        thread = threading.Thread(target=self.agent.search, args=(self.board,),
+                                  kwargs={'movetime': movetime, 'ponder': True}, daemon=True)
+        thread.start()
+        return thread
+
+    def test_ponderhit_before_search_starts(self):
+        start = time.monotonic()
+        thread = self._ponder(0.1)
+        self.agent.ponderhit()
+        thread.join(0.1 + TOLERANCE)
+        self.assertFalse(thread.is_alive())
+        self.assertLess(time.monotonic() - start, 0.1 + TOLERANCE)
+
+    def test_ponderhit_during_search(self):
+        thread = self._ponder(0.1)
+        time.sleep(0.2)
+        self.assertTrue(thread.is_alive())
+        self.agent.ponderhit(0.1)
+        thread.join(0.1 + TOLERANCE)
+        self.assertFalse(thread.is_alive())
+
+    def test_uci_ponderhit_straight_after_go_ponder(self):
+        output = io.StringIO()
+        engine = UCIEngine(output)
+        engine.handle('position startpos moves e2e4')
+        engine.handle('go ponder movetime 100')
+        engine.handle('ponderhit')
+        engine.search_thread.join(0.1 + TOLERANCE)
+        self.assertFalse(engine.search_thread.is_alive())
+        self.assertIn('bestmove', output.getvalue())
+        engine.handle('quit')
+
+
+if __name__ == '__main__':
+    unittest.main()
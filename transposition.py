@@ -0,0 +1,312 @@
+import mmap
+import os
+import struct
+from multiprocessing import shared_memory
+
+import chess
+
+# Bound types stored with each entry.
+EXACT = 0
+LOWER_BOUND = 1
+UPPER_BOUND = 2
+
+# Scores are stored as unsigned 32-bit integers, offset by this amount.
+SCORE_OFFSET = 1 << 31
+
+# Tables kept in a file start with a header of a magic number and the number of entries.
+FILE_MAGIC = b'CTT1'
+FILE_HEADER_STRUCT = struct.Struct('<4s4xQ')
+
+
+def encode_move(move):
+    """Packs a move into a 15-bit integer. Zero means no move."""
+    if move is None:
+        return 0
+    return move.from_square | (move.to_square << 6) | ((move.promotion or 0) << 12)
+
+
+def decode_move(code):
+    """Unpacks a move packed by encode_move."""
+    if not code:
+        return None
+    return chess.Move(code & 0x3f, (code >> 6) & 0x3f, (code >> 12) or None)
+
+
+class TranspositionTable:
+    """A fixed-size hash table of search results keyed by Zobrist hashes.
+
+    Each entry takes two 64-bit words: the key XOR-ed with the data, and the
+    data itself (move, score, depth, bound and generation). An entry is only
+    trusted if the key recovered from both words matches the probed key.
+
+    Given a path, the table is a memory-mapped file instead. It outlives the
+    process, and any number of processes can map it at once. With warm_start,
+    the entries already in a file of the right size are kept. If the file
+    cannot be created, the table is kept in memory and its path is set to None.
+    """
+
+    ENTRY_SIZE = 16
+
+    def __init__(self, size_mb=16, shared=False, path=None, warm_start=True):
+        self.shared = shared
+        self.shared_memory = None
+        self.path = path
+        self._mmap = None
+
+        if path is not None and warm_start:
+            size = self._entries(size_mb)
+            try:
+                if not self._map_file(size):
+                    self._create_file(size, replace=False)
+                self._owner = True
+                return
+            except OSError:
+                self.path = None
+
+        self.resize(size_mb)
+
+    @classmethod
+    def attach(cls, name):
+        """Opens a shared table created by another process."""
+
+        table = cls.__new__(cls)
+        table.shared = True
+        # Child processes share the creator's resource tracker, which unlinks the memory when the creator exits.
+        table.shared_memory = shared_memory.SharedMemory(name=name)
+        table._allocate(table.shared_memory.buf, table.shared_memory.size // cls.ENTRY_SIZE)
+        table._owner = False
+        return table
+
+    @classmethod
+    def attach_file(cls, path):
+        """Opens a table kept in a file by another process, whatever its size."""
+
+        table = cls.__new__(cls)
+        table.shared = True
+        table.shared_memory = None
+        table.path = path
+        table._mmap = None
+        if not table._map_file():
+            raise ValueError(f'{path} does not hold a transposition table')
+        table._owner = False
+        return table
+
+    @classmethod
+    def _entries(cls, size_mb):
+        """Returns the number of entries that fit in size_mb megabytes, rounded down to a power of two."""
+
+        # With a power of two number of entries, the index is a mask of the key.
+        entries = max(1, int(size_mb * 1024 * 1024) // cls.ENTRY_SIZE)
+        return 1 << (entries.bit_length() - 1)
+
+    def resize(self, size_mb):
+        """Reallocates the table to use at most size_mb megabytes. Clears all entries."""
+
+        size = self._entries(size_mb)
+
+        self.close()
+
+        # A table in a file starts a new file, and a shared table can be used by several processes at once.
+        if self.path is not None:
+            try:
+                self._create_file(size)
+                self._owner = True
+                return
+            except OSError:
+                self.path = None
+
+        if self.shared:
+            self.shared_memory = shared_memory.SharedMemory(create=True, size=size * self.ENTRY_SIZE)
+            self._allocate(self.shared_memory.buf, size)
+        else:
+            self._allocate(bytearray(size * self.ENTRY_SIZE), size)
+
+        self._owner = True
+
+    def _allocate(self, buffer, size):
+        """Uses a zeroed buffer of size entries as the table."""
+
+        self.size = size
+        self.mask = size - 1
+
+        self._buffer = buffer
+        self._slots = memoryview(buffer).cast('B').cast('Q')
+
+        self.generation = 0
+        self.reset_counters()
+
+    def _map_file(self, size=None):
+        """Maps the table's file if it holds a table of size entries, or of any size if size is None.
+
+        Returns whether it did.
+        """
+
+        try:
+            with open(self.path, 'r+b') as file:
+                header = file.read(FILE_HEADER_STRUCT.size)
+                if len(header) < FILE_HEADER_STRUCT.size:
+                    return False
+
+                magic, entries = FILE_HEADER_STRUCT.unpack(header)
+                file_size = os.fstat(file.fileno()).st_size
+                if (magic != FILE_MAGIC or entries < 1 or entries & (entries - 1)
+                        or (size is not None and entries != size)
+                        or file_size != FILE_HEADER_STRUCT.size + entries * self.ENTRY_SIZE):
+                    return False
+
+                self._mmap = mmap.mmap(file.fileno(), file_size)
+        except OSError:
+            return False
+
+        # Start reading the entries in from disk before the search needs them.
+        if hasattr(mmap, 'MADV_WILLNEED'):
+            self._mmap.madvise(mmap.MADV_WILLNEED)
+
+        self._allocate(memoryview(self._mmap)[FILE_HEADER_STRUCT.size:], entries)
+        return True
+
+    def _create_file(self, size, replace=True):
+        """Creates the table's file as an empty table of size entries, and maps it.
+
+        Without replace, a table of the same size that another process has just
+        created is used instead. Raises OSError if the file cannot be created.
+        """
+
+        # The file is written in full before it appears under its name, so other processes never map half a table.
+        temporary_path = f'{self.path}.{os.getpid()}.tmp'
+        try:
+            with open(temporary_path, 'wb') as file:
+                file.write(FILE_HEADER_STRUCT.pack(FILE_MAGIC, size))
+                file.truncate(FILE_HEADER_STRUCT.size + size * self.ENTRY_SIZE)
+
+            # Linking fails if the file exists, so of several processes creating it at once, only one succeeds.
+            # The others map the winner's file, rather than each mapping a file the next one unlinks.
+            try:
+                os.link(temporary_path, self.path)
+            except FileExistsError:
+                if replace or not self._map_file(size):
+                    # The new file replaces the old one in a single step. Processes still using the old file
+                    # keep their mapping of it, rather than finding it truncated beneath them.
+                    os.replace(temporary_path, self.path)
+            except OSError:
+                # Some file systems have no hard links.
+                os.replace(temporary_path, self.path)
+        finally:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+
+        if self._mmap is None and not self._map_file(size):
+            raise OSError(f'could not map {self.path}')
+
+    def close(self):
+        """Releases shared memory or the file mapping held by the table."""
+
+        if self._mmap is not None:
+            # Views of the mapping must be released before it can be closed. The file itself is kept.
+            self._slots.release()
+            self._buffer.release()
+            self._slots = self._buffer = None
+            self._mmap.close()
+            self._mmap = None
+            return
+
+        if self.shared_memory is None:
+            return
+
+        # Views of the memory must be released before it can be closed.
+        self._slots.release()
+        self._slots = self._buffer = None
+        self.shared_memory.close()
+        if self._owner:
+            self.shared_memory.unlink()
+        self.shared_memory = None
+
+    def clear(self):
+        """Removes all entries from the table."""
+        self._buffer[:] = bytes(len(self._buffer))
+        self.generation = 0
+
+    def reset_counters(self):
+        """Resets the usage counters."""
+        self.probes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.overwrites = 0
+
+    def new_search(self, generation=None):
+        """Ages all existing entries, so they are replaced before fresh ones.
+
+        Processes sharing a table should pass the same generation.
+        """
+        if generation is None:
+            generation = self.generation + 1
+        self.generation = generation & 0x3f
+
+    def probe(self, key):
+        """Returns (depth, score, bound, move) for a position, or None if it is not stored.
+
+        The move is packed as by encode_move.
+        """
+
+        self.probes += 1
+
+        index = (key & self.mask) << 1
+        data = self._slots[index + 1]
+
+        if not data or self._slots[index] ^ data != key:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+
+        move = data & 0x7fff
+        score = ((data >> 16) & 0xffffffff) - SCORE_OFFSET
+        depth = (data >> 48) & 0xff
+        bound = (data >> 56) & 0x3
+
+        return depth, score, bound, move
+
+    def store(self, key, depth, score, bound, move):
+        """Stores a search result, using a depth-preferred replacement policy. The move is packed as by encode_move."""
+
+        index = (key & self.mask) << 1
+        old_data = self._slots[index + 1]
+
+        if old_data:
+
+            old_key = self._slots[index] ^ old_data
+            old_depth = (old_data >> 48) & 0xff
+            old_generation = old_data >> 58
+
+            if old_key == key:
+                # Keep the previous best move if there is no new one.
+                if not move:
+                    move = old_data & 0x7fff
+            else:
+                # Keep deeper entries from the current search.
+                if old_generation == self.generation and depth < old_depth:
+                    return
+                self.overwrites += 1
+
+        data = (
+            move
+            | ((int(score) + SCORE_OFFSET) & 0xffffffff) << 16
+            | min(depth, 0xff) << 48
+            | bound << 56
+            | self.generation << 58
+        )
+
+        self._slots[index] = key ^ data
+        self._slots[index + 1] = data
+        self.stores += 1
+
+    def hashfull(self):
+        """Returns the permille of sampled entries used in the current search."""
+        sample = min(self.size, 1000)
+        used = 0
+        for i in range(sample):
+            data = self._slots[2 * i + 1]
+            if data and data >> 58 == self.generation:
+                used += 1
+        return used * 1000 // sample
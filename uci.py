@@ -0,0 +1,327 @@
+import sys
+import threading
+import time
+
+import chess
+
+from minimax import BITBASE_EVALUATION, MATE_EVALUATION, Agent
+
+ENGINE_NAME = 'chess-ai'
+ENGINE_AUTHOR = 'kz4killua'
+
+# Options, with their UCI declarations and defaults.
+DEFAULT_HASH = 16
+DEFAULT_THREADS = 1
+OPTIONS = (
+    f'option name Hash type spin default {DEFAULT_HASH} min 1 max 4096',
+    f'option name Threads type spin default {DEFAULT_THREADS} min 1 max 64',
+    'option name Ponder type check default false',
+    'option name BookFile type string default <empty>',
+    'option name BitbasePath type string default <empty>',
+    'option name HashFile type string default <empty>',
+)
+
+# Seconds kept in reserve for communication when playing on a clock.
+MOVE_OVERHEAD = 0.05
+
+# Moves assumed to be left in the game when the clock does not say.
+DEFAULT_MOVES_TO_GO = 30
+
+# Limits of 'go' that take a number. Other arguments, such as searchmoves lists, are ignored.
+GO_LIMITS = ('depth', 'movetime', 'nodes', 'wtime', 'btime', 'winc', 'binc', 'movestogo')
+
+
+def allocate_time(time_left, increment=0, moves_to_go=None):
+    """Returns the seconds to spend on a move, given the time left and increment in seconds."""
+
+    moves_to_go = moves_to_go or DEFAULT_MOVES_TO_GO
+    budget = time_left / moves_to_go + increment * 3 / 4
+
+    # Never risk more than half of what is left.
+    return max(0.01, min(budget, time_left / 2 - MOVE_OVERHEAD))
+
+
+def format_score(evaluation, board, principal_variation):
+    """Formats an evaluation from white's point of view as a UCI score for the side to move."""
+
+    score = evaluation if board.turn == chess.WHITE else -evaluation
+
+    # Mates found by the search are not scored by distance, so count the moves in the line instead.
+    if abs(score) >= MATE_EVALUATION:
+        plies = max(1, len(principal_variation))
+    elif abs(score) > BITBASE_EVALUATION - 1000:
+        plies = BITBASE_EVALUATION - abs(score)
+    else:
+        return f'cp {score}'
+
+    moves = (plies + 1) // 2
+    return f'mate {moves if score > 0 else -moves}'
+
+
+class UCIEngine:
+    """Speaks the UCI protocol on top of an Agent, searching on a worker thread."""
+
+    def __init__(self, output=sys.stdout):
+        self.output = output
+        self._output_lock = threading.Lock()
+
+        self.hash_size_mb = DEFAULT_HASH
+        self.workers = DEFAULT_THREADS
+        self.book_path = None
+        self.bitbase_path = None
+        self.hash_path = None
+        self.agent = None
+
+        self.board = chess.Board()
+        self.search_thread = None
+        self.stop_event = threading.Event()
+        self._infinite = False
+        self._ponder_movetime = None
+
+    def send(self, line):
+        """Writes a line to the GUI."""
+        with self._output_lock:
+            self.output.write(line + '\n')
+            self.output.flush()
+
+    def handle(self, line):
+        """Handles one command. Returns False when the engine should quit."""
+
+        tokens = line.split()
+        if not tokens:
+            return True
+
+        command, arguments = tokens[0], tokens[1:]
+
+        # Bad input from the GUI is reported, rather than bringing the engine down.
+        try:
+            return self._handle_command(command, arguments)
+        except ValueError as error:
+            self.send(f'info string error: {error}')
+            return True
+
+    def _handle_command(self, command, arguments):
+        """Handles one command, split into its name and arguments."""
+
+        if command == 'uci':
+            self.send(f'id name {ENGINE_NAME}')
+            self.send(f'id author {ENGINE_AUTHOR}')
+            for option in OPTIONS:
+                self.send(option)
+            self.send('uciok')
+        elif command == 'isready':
+            self._get_agent()
+            self.send('readyok')
+        elif command == 'setoption':
+            self.stop()
+            self.set_option(arguments)
+        elif command == 'ucinewgame':
+            self.stop()
+            # A hash file is kept between games on purpose.
+            table = self._get_agent().transposition_table
+            if table.path is None:
+                table.clear()
+        elif command == 'position':
+            self.stop()
+            self.set_position(arguments)
+        elif command == 'go':
+            self.stop()
+            self.go(arguments)
+        elif command == 'stop':
+            self.stop()
+        elif command == 'ponderhit':
+            self.ponderhit()
+        elif command == 'quit':
+            self.stop()
+            self.close()
+            return False
+
+        return True
+
+    def set_option(self, arguments):
+        """Handles 'setoption name <name> [value <value>]'."""
+
+        if 'name' not in arguments:
+            return
+
+        name_start = arguments.index('name') + 1
+        if 'value' in arguments:
+            value_start = arguments.index('value')
+            name = ' '.join(arguments[name_start:value_start])
+            value = ' '.join(arguments[value_start + 1:])
+        else:
+            name = ' '.join(arguments[name_start:])
+            value = ''
+
+        name = name.lower()
+        path = value if value and value != '<empty>' else None
+
+        # The agent is set up again with the new options when it is next needed.
+        if name == 'hash':
+            self.hash_size_mb = max(1, int(value))
+            if self.agent is not None and self.workers == 1:
+                self.agent.transposition_table.resize(self.hash_size_mb)
+                return
+        elif name == 'threads':
+            self.workers = max(1, int(value))
+        elif name == 'bookfile':
+            self.book_path = path
+        elif name == 'bitbasepath':
+            self.bitbase_path = path
+        elif name == 'hashfile':
+            self.hash_path = path
+        else:
+            return
+
+        self.close()
+
+    def set_position(self, arguments):
+        """Handles 'position [startpos | fen <fen>] [moves <move>...]'."""
+
+        if 'moves' in arguments:
+            moves = arguments[arguments.index('moves') + 1:]
+            arguments = arguments[:arguments.index('moves')]
+        else:
+            moves = []
+
+        if arguments and arguments[0] == 'fen':
+            board = chess.Board(' '.join(arguments[1:]))
+        else:
+            board = chess.Board()
+
+        for move in moves:
+            board.push_uci(move)
+
+        self.board = board
+
+    def go(self, arguments):
+        """Handles 'go' with depth, movetime, nodes, clock, ponder and infinite limits."""
+
+        limits = {}
+        flags = set()
+        i = 0
+        while i < len(arguments):
+            if arguments[i] in ('ponder', 'infinite'):
+                flags.add(arguments[i])
+            elif arguments[i] in GO_LIMITS and i + 1 < len(arguments):
+                try:
+                    limits[arguments[i]] = int(arguments[i + 1])
+                    i += 1
+                except ValueError:
+                    pass
+            i += 1
+
+        board = self.board
+        movetime = None
+
+        if 'movetime' in limits:
+            movetime = limits['movetime'] / 1000
+        elif 'wtime' in limits or 'btime' in limits:
+            side = 'w' if board.turn == chess.WHITE else 'b'
+            time_left = limits.get(f'{side}time', 0) / 1000
+            increment = limits.get(f'{side}inc', 0) / 1000
+            movetime = allocate_time(time_left, increment, limits.get('movestogo'))
+
+        self.stop_event = threading.Event()
+        self._infinite = 'infinite' in flags
+        self._ponder_movetime = movetime
+
+        # The agent is set up here rather than on the worker, so a ponderhit sent straight after is not lost.
+        agent = self._get_agent()
+        if 'ponder' in flags:
+            agent.begin_ponder()
+
+        self.search_thread = threading.Thread(
+            target=self._search,
+            args=(board.copy(), movetime, limits.get('depth'), limits.get('nodes'), 'ponder' in flags),
+            daemon=True,
+        )
+        self.search_thread.start()
+
+    def _search(self, board, movetime, max_depth, max_nodes, ponder):
+        """Runs a search on the worker thread and reports its best move."""
+
+        agent = self._get_agent()
+        start = time.monotonic()
+
+        def report(depth, evaluation, principal_variation):
+            elapsed = max(time.monotonic() - start, 1e-6)
+            self.send(
+                f'info depth {depth} score {format_score(evaluation, board, principal_variation)}'
+                f' nodes {agent.nodes} nps {int(agent.nodes / elapsed)} time {int(elapsed * 1000)}'
+                f' hashfull {agent.transposition_table.hashfull()}'
+                f' pv {" ".join(move.uci() for move in principal_variation)}'
+            )
+
+        def report_progress(stats):
+            self.send(
+                f'info nodes {stats.nodes} nps {int(stats.nps)} time {int(stats.elapsed * 1000)}'
+                f' hashfull {agent.transposition_table.hashfull()}'
+            )
+
+        move, evaluation = agent.search(
+            board, movetime=movetime, max_depth=max_depth, max_nodes=max_nodes,
+            stop_event=self.stop_event, ponder=ponder, on_iteration=report, on_progress=report_progress,
+        )
+
+        # An infinite search must not report its move until it is stopped.
+        if self._infinite:
+            self.stop_event.wait()
+
+        if move is None:
+            self.send('bestmove 0000')
+            return
+
+        line = agent.principal_variation
+        if len(line) >= 2 and line[0] == move:
+            self.send(f'bestmove {move.uci()} ponder {line[1].uci()}')
+        else:
+            self.send(f'bestmove {move.uci()}')
+
+    def ponderhit(self):
+        """The expected move was played, so the pondering search now gets its time budget."""
+        if self.agent is not None:
+            self.agent.ponderhit(self._ponder_movetime)
+
+    def stop(self):
+        """Stops any running search, waiting for it to report its move."""
+
+        if self.search_thread is None:
+            return
+
+        self.stop_event.set()
+        self.search_thread.join()
+        self.search_thread = None
+
+    def _get_agent(self):
+        """Returns the agent, setting it up with the current options if necessary."""
+
+        if self.agent is None:
+            self.agent = Agent(
+                hash_size_mb=self.hash_size_mb, workers=self.workers,
+                book_path=self.book_path, bitbase_path=self.bitbase_path, hash_path=self.hash_path,
+            )
+
+        return self.agent
+
+    def close(self):
+        """Releases the agent."""
+        if self.agent is not None:
+            self.agent.close()
+            self.agent = None
+
+
+def main():
+
+    engine = UCIEngine()
+
+    for line in sys.stdin:
+        if not engine.handle(line):
+            break
+    else:
+        engine.stop()
+        engine.close()
+
+
+if __name__ == '__main__':
+    main()